@@ -0,0 +1,146 @@
+"""
+Offline analysis of recorded videos without gui
+
+python3 batch.py data/half_1080p.mp4 --output results
+python3 batch.py data/ --output results --workers 3
+"""
+
+import argparse
+import concurrent.futures
+import os
+import pathlib
+import time
+
+import numpy as np
+
+from src import capture_device, export, pli, session, tracker
+
+BLOCK_SIZE = 16  # frames of which the angles are estimated at once
+
+
+def process_cl_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input',
+                        type=str,
+                        nargs='+',
+                        help='videos or directories of videos')
+    parser.add_argument('--output', type=str, default='results')
+    parser.add_argument('--workers',
+                        type=int,
+                        help='number of videos processed in parallel')
+    parser.add_argument('--passes',
+                        type=int,
+                        default=3,
+                        help='maximal number of times a video is read')
+    parser.add_argument('--session', action='store_true')
+    parser.add_argument('--insert-threshold', type=float, default=2.5)
+    parser.add_argument('--least-squares', action='store_true')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--num-rot', type=int, default=18)
+    parser.add_argument('--scratch-dir', type=str)
+    parser.add_argument('--oversample', type=int, default=0)
+    parser.add_argument('--detection-scale', type=float, default=1.0)
+    parser.add_argument('--full-detection-every', type=int, default=0)
+    return parser.parse_args()
+
+
+def videos(inputs):
+    """ video files of the input files and directories """
+    files = []
+    for elm in inputs:
+        if os.path.isdir(elm):
+            files.extend(
+                sorted(
+                    os.path.join(elm, file)
+                    for file in os.listdir(elm)
+                    if file.endswith('.mp4')))
+        else:
+            files.append(elm)
+    return files
+
+
+def insert(tracker_, pli_, frames):
+    """ inserts a block of frames, True if the measurement is done """
+    for frame, angle in zip(frames, tracker_.current_angles(frames)):
+        if np.isnan(angle):
+            continue
+        frame = tracker_.crop_img(frame)
+        frame = tracker_.mask_img(frame)
+        pli_.insert(frame, angle)
+        if pli_.measurment_done():
+            return True
+    return False
+
+
+def process(file_name, args):
+    """ measurement and analysis of a single video """
+    start = time.perf_counter()
+
+    device = capture_device.CapDev(port=None,
+                                   port_list=(),
+                                   file_name=file_name)
+    tracker_ = tracker.Tracker(num_sticker=10,
+                               sticker_zero_id=10,
+                               detection_scale=args.detection_scale,
+                               full_detection_every=args.full_detection_every)
+    pli_ = pli.PLI(np.deg2rad(args.insert_threshold), args.least_squares,
+                   args.threads, args.num_rot, args.scratch_dir,
+                   args.oversample)
+
+    num_frames = device.get_frame_count() * args.passes
+    block = []
+    for _ in range(num_frames):
+        valid, frame = device.get_frame()
+        if not valid:
+            break
+
+        if not tracker_.calibrated():
+            tracker_.calibrate(frame)
+            continue
+
+        block.append(frame)
+        if len(block) == BLOCK_SIZE:
+            if insert(tracker_, pli_, block):
+                break
+            block = []
+
+    if not pli_.measurment_done():
+        insert(tracker_, pli_, block)
+
+    device.release_device()
+
+    if not pli_.measurment_done():
+        return file_name, 'measurement incomplete', time.perf_counter() - start
+
+    pli_.analyse(tracker_.get_mask())
+
+    path = os.path.join(args.output, pathlib.Path(file_name).stem)
+    os.makedirs(path, exist_ok=True)
+    export.write_images(path, pli_, tracker_)
+    if args.session:
+        session.save(os.path.join(path, 'session.pli'), {
+            'pli': pli_.state(),
+            'tracker': tracker_.state()
+        })
+
+    return file_name, path, time.perf_counter() - start
+
+
+def main():
+    args = process_cl_args()
+    files = videos(args.input)
+
+    workers = args.workers or min(len(files), os.cpu_count() or 1)
+    if args.threads is None:
+        # share the cores between the videos
+        args.threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+
+    with concurrent.futures.ProcessPoolExecutor(max(1, workers)) as pool:
+        futures = [pool.submit(process, file, args) for file in files]
+        for future in concurrent.futures.as_completed(futures):
+            file_name, result, seconds = future.result()
+            print(f'{file_name}: {result} ({seconds:.1f} s)')
+
+
+if __name__ == '__main__':
+    main()
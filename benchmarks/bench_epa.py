@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Micro benchmarks for the analysis kernels in src/epa.py
+
+python3 -m benchmarks.bench_epa --output epa.json
+python3 -m benchmarks.bench_epa --compare epa.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+
+import numba
+import numpy as np
+
+from src import epa
+
+from . import common
+
+RESOLUTIONS = {
+    '540p': (540, 960),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+    '4k': (2160, 3840),
+}
+
+
+def synthetic_stack(shape: tuple, num_rot: int, seed: int = 42) -> dict:
+    """ modalities and uint8 (x,y,rho) stack of a random PLI signal """
+    rng = np.random.default_rng(seed)
+    transmittance = rng.uniform(20, 220, shape)
+    direction = rng.uniform(0, np.pi, shape)
+    retardation = rng.uniform(0, 0.9, shape)
+
+    rho = np.linspace(0, np.pi, num_rot, False)
+    stack = np.empty(shape + (num_rot,), np.uint8)
+    for i, r in enumerate(rho):
+        stack[:, :, i] = transmittance / 2 * (1 + retardation *
+                                              np.sin(2 * (r - direction)))
+
+    inclination, _ = epa.simple_incl(transmittance, retardation)
+    return {
+        'stack': stack,
+        'transmittance': transmittance,
+        'direction': direction,
+        'retardation': retardation,
+        'inclination': inclination,
+    }
+
+
+def kernels(data: dict) -> dict:
+    """ name -> callable without arguments """
+    inclination = data['inclination']
+    x = np.cos(inclination) * np.cos(data['direction'])
+    y = np.cos(inclination) * np.sin(data['direction'])
+    z = np.sin(inclination)
+    rot = np.dot(epa.rot_x(np.deg2rad(10)), epa.rot_z(0))
+
+    return {
+        'epa':
+            lambda: epa.epa(data['stack']),
+        'epa_parallel':
+            lambda: epa.epa_parallel(data['stack']),
+        'simple_incl':
+            lambda: epa.simple_incl(data['transmittance'], data['retardation']
+                                   ),
+        'calc_tilts':
+            lambda: epa.calc_tilts(data['transmittance'], data[
+                'direction'], data['retardation'], inclination),
+        '_calc_tilt':
+            lambda: epa._calc_tilt(x, y, z, rot),
+        'fom':
+            lambda: epa.fom(data['direction'], inclination),
+        'fom_lut':
+            lambda: epa.fom(data['direction'], inclination, lut=True),
+    }
+
+
+def measure(fun, warmup: int, repeat: int) -> dict:
+    # warm up runs include numba jit compilation and lookup table caching
+    for _ in range(warmup):
+        fun()
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - t0)
+
+    # numpy allocations are traced, numba internal allocations are not
+    tracemalloc.start()
+    fun()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_ms': float(np.median(times) * 1e3),
+        'p95_ms': float(np.percentile(times, 95) * 1e3),
+        'peak_mb': peak / 2**20,
+    }
+
+
+def process_cl_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions',
+                        nargs='+',
+                        choices=RESOLUTIONS.keys(),
+                        default=list(RESOLUTIONS.keys()))
+    parser.add_argument('--rotations',
+                        nargs='+',
+                        type=int,
+                        choices=[18, 36],
+                        default=[18, 36])
+    parser.add_argument('--kernels', nargs='+')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--compare', type=str)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = process_cl_args()
+
+    results = []
+    for resolution in args.resolutions:
+        for num_rot in args.rotations:
+            data = synthetic_stack(RESOLUTIONS[resolution], num_rot)
+            for name, fun in kernels(data).items():
+                if args.kernels is not None and name not in args.kernels:
+                    continue
+                res = measure(fun, args.warmup, args.repeat)
+                res.update(kernel=name,
+                           resolution=resolution,
+                           rotations=num_rot)
+                results.append(res)
+                print(f'{name:>14} {resolution:>6} {num_rot:>3}: ' +
+                      f'median {res["median_ms"]:9.2f} ms, ' +
+                      f'p95 {res["p95_ms"]:9.2f} ms, ' +
+                      f'peak {res["peak_mb"]:8.1f} MB')
+            del data
+
+    if args.output:
+        common.write(args.output,
+                     results,
+                     numba=numba.__version__,
+                     numba_threads=numba.config.NUMBA_NUM_THREADS)
+
+    if args.compare:
+        common.check(args.compare, results,
+                     ('kernel', 'resolution', 'rotations'), args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and throughput of src/tracker.py on the demo videos
+
+python3 -m benchmarks.bench_tracker --output tracker.json
+python3 -m benchmarks.bench_tracker --compare tracker.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from src import capture_device, tracker
+
+from . import common
+
+VIDEOS = [
+    os.path.join(capture_device.PATH, file)
+    for file in ['half_540p.mp4', 'half_720p.mp4', 'half_1080p.mp4']
+]
+
+
+def replay(file_name: str, max_frames: int, **kwargs) -> dict | None:
+    """ calibration and tracking of a video, decoding is not timed """
+    device = capture_device.CapDev(port=None,
+                                   port_list=(),
+                                   file_name=file_name)
+    num_frames = min(device.get_frame_count(), max_frames)
+    if num_frames == 0:
+        return None
+
+    tracker_ = tracker.Tracker(num_sticker=10, sticker_zero_id=10, **kwargs)
+    calibration_frames = None
+    calibration_time = 0.0
+    times = []
+    angles = []
+    for i in range(num_frames):
+        valid, frame = device.get_frame()
+        if not valid or frame is None:
+            break
+
+        t0 = time.perf_counter()
+        if calibration_frames is None:
+            if tracker_.calibrate(frame):
+                calibration_frames = i + 1
+            calibration_time += time.perf_counter() - t0
+            continue
+        angle = tracker_.current_angle(frame)
+        times.append(time.perf_counter() - t0)
+        angles.append(np.nan if angle is None else angle)
+    device.release_device()
+
+    result = {
+        'frames': num_frames,
+        'calibration_frames': calibration_frames,
+        'calibration_ms': calibration_time * 1e3,
+    }
+    if not times:
+        return result
+
+    measured = np.array(angles)
+    found = measured[~np.isnan(measured)]
+    steps = np.diff(np.unwrap(found, period=np.pi))
+    # the rotation is smooth, second differences are dominated by noise
+    # with a variance of 6 sigma^2
+    jitter = None
+    if steps.size > 1:
+        jitter = float(np.rad2deg(np.std(np.diff(steps)) / np.sqrt(6)))
+
+    result.update(
+        median_ms=float(np.median(times) * 1e3),
+        p95_ms=float(np.percentile(times, 95) * 1e3),
+        detection_rate=float(found.size / measured.size),
+        step_deg=float(np.rad2deg(np.median(np.abs(steps))))
+        if steps.size else None,
+        jitter_deg=jitter,
+    )
+    return result
+
+
+def process_cl_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', nargs='+', default=VIDEOS)
+    parser.add_argument('--max-frames', type=int, default=600)
+    parser.add_argument('--detection-scale',
+                        nargs='+',
+                        type=float,
+                        default=[1.0])
+    parser.add_argument('--full-detection-every',
+                        nargs='+',
+                        type=int,
+                        default=[0])
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--compare', type=str)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = process_cl_args()
+
+    results = []
+    for video in args.videos:
+        for scale in args.detection_scale:
+            for every in args.full_detection_every:
+                res = replay(video,
+                             args.max_frames,
+                             detection_scale=scale,
+                             full_detection_every=every)
+                name = os.path.basename(video)
+                if res is None:
+                    print(f'{name}: no frames, skipped')
+                    continue
+                res.update(video=name,
+                           detection_scale=scale,
+                           full_detection_every=every)
+                results.append(res)
+                if 'median_ms' not in res:
+                    print(f'{name:>16} {scale:4.2f} {every:>3}: not calibrated')
+                    continue
+                jitter = '-'
+                if res['jitter_deg'] is not None:
+                    jitter = f'{res["jitter_deg"]:6.3f}'
+                print(f'{name:>16} {scale:4.2f} {every:>3}: ' +
+                      f'median {res["median_ms"]:7.2f} ms, ' +
+                      f'p95 {res["p95_ms"]:7.2f} ms, ' +
+                      f'detected {res["detection_rate"]:6.1%}, ' +
+                      f'jitter {jitter} deg, ' +
+                      f'calibrated after {res["calibration_frames"]} frames ' +
+                      f'({res["calibration_ms"]:.0f} ms)')
+
+    if args.output:
+        common.write(args.output, results, opencv=cv2.__version__)
+
+    if args.compare:
+        common.check(args.compare, results,
+                     ('video', 'detection_scale', 'full_detection_every'),
+                     args.threshold)
+
+
+if __name__ == '__main__':
+    main()
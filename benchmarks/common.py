@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Result files and regression checks shared by the benchmarks
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import platform
+import sys
+
+import numpy as np
+
+
+def write(file_name: str, results: list, **versions) -> None:
+    """ results with the date and the environment, e.g. library versions """
+    with open(file_name, 'w') as file:
+        json.dump(
+            {
+                'date': datetime.datetime.now().isoformat(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                **versions,
+                'cpu_count': os.cpu_count(),
+                'results': results,
+            },
+            file,
+            indent=2)
+
+
+def compare(results: list, reference: list, keys: tuple,
+            threshold: float) -> list:
+    """ results with a median slower than reference by more than threshold """
+
+    def key(elm):
+        return tuple(elm[name] for name in keys)
+
+    references = {key(elm): elm for elm in reference}
+
+    regressions = []
+    for elm in results:
+        ref = references.get(key(elm))
+        # e.g. a video without calibration has no timing
+        if ref is None or 'median_ms' not in elm or 'median_ms' not in ref:
+            continue
+        ratio = elm['median_ms'] / ref['median_ms']
+        if ratio > 1 + threshold:
+            regressions.append(dict(elm, ratio=ratio))
+    return regressions
+
+
+def check(file_name: str, results: list, keys: tuple,
+          threshold: float) -> None:
+    """ prints regressions against a result file, exits with 1 if any """
+    with open(file_name, 'r') as file:
+        reference = json.load(file)['results']
+
+    regressions = compare(results, reference, keys, threshold)
+    for elm in regressions:
+        name = ' '.join(str(elm[key]) for key in keys)
+        print(f'REGRESSION {name}: {elm["ratio"]:.2f}x slower')
+    if regressions:
+        sys.exit(1)
@@ -15,6 +15,17 @@ def process_cl_args():
     parser.add_argument('--fps', type=int)
     parser.add_argument('--first-n', action='store_true')
     parser.add_argument('--insert-threshold', type=float, default=2.5)
+    parser.add_argument('--least-squares', action='store_true')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--num-rot', type=int, default=18)
+    parser.add_argument('--scratch-dir', type=str)
+    parser.add_argument('--oversample', type=int, default=0)
+    parser.add_argument('--detection-scale', type=float, default=1.0)
+    parser.add_argument('--full-detection-every', type=int, default=0)
+    parser.add_argument('--process-backend', action='store_true')
+    parser.add_argument('--threaded-capture', action='store_true')
+    parser.add_argument('--capture-buffer', type=int, default=8)
+    parser.add_argument('--keep-all-frames', action='store_true')
 
     parsed_args, unparsed_args = parser.parse_known_args()
     return parsed_args, unparsed_args
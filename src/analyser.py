@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import contextlib
+import traceback
+import sys
+
+from PyQt5 import QtCore
+
+from . import analysis
+from . import shared_analysis
+
+
+class WorkerSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal()
+    error = QtCore.pyqtSignal(tuple)
+    result = QtCore.pyqtSignal(tuple)
+    progress = QtCore.pyqtSignal(tuple)
+
+
+class PLIAnalyser(QtCore.QRunnable):
+
+    def __init__(self,
+                 images,
+                 coefficients=None,
+                 num_threads=None,
+                 mask=None,
+                 coarse_factor=4,
+                 cancel=None):
+        """
+        images: measured image stack
+        coefficients: accumulated fourier coefficients of images, optional
+        num_threads: number of analysis threads, all cores if None
+        mask: only masked pixels are analysed, optional
+        coarse_factor: downsampling of the preliminary result, 1 to disable
+        cancel: threading.Event, the analysis stops early once set
+        """
+        super(PLIAnalyser, self).__init__()
+        self.images = images
+        self.coefficients = coefficients
+        self.num_threads = num_threads
+        self.mask = mask
+        self.coarse_factor = coarse_factor
+        self.cancel = cancel
+        self.signals = WorkerSignals()
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        try:
+            with self._job() as job:
+                if self.coarse_factor > 1:
+                    print('thread: running coarse analysis ...')
+                    self.signals.progress.emit(
+                        self._analyse(job, self.coarse_factor))
+                print('thread: running analysis ...')
+                result = self._analyse(job, 1)
+            print('thread: analysis finished')
+        except analysis.Cancelled:
+            print('thread: analysis cancelled')
+        except:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()  # Done
+
+    def _job(self):
+        """ resources shared by the passes of the pyramid """
+        return contextlib.nullcontext()
+
+    def _analyse(self, job, factor):
+        return analysis.analyse(self.images, self.coefficients,
+                                self.num_threads, self.mask, factor,
+                                self.cancel)
+
+
+class ProcessAnalyser(PLIAnalyser):
+    """ analysis in a worker process, the gui thread keeps the interpreter """
+
+    def _job(self):
+        # the inputs are shared once for the coarse and the full pass
+        return shared_analysis.Job(self.images, self.coefficients, self.mask)
+
+    def _analyse(self, job, factor):
+        return job.analyse(factor, self.num_threads, self.cancel)
@@ -0,0 +1,142 @@
+"""
+Analysis chain of a measured PLI image stack, independent of any gui
+"""
+
+from __future__ import annotations
+
+import typing
+
+import numpy as np
+
+from . import data_classes
+from . import epa
+
+
+class Cancelled(Exception):
+    """ analysis was cancelled before it finished """
+
+
+class CancelFlag(typing.Protocol):
+    """ e.g. a threading.Event """
+
+    def is_set(self) -> bool:
+        ...
+
+
+def _check(cancel: CancelFlag | None) -> None:
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+def analyse(images: data_classes.Images,
+            coefficients: np.ndarray | None = None,
+            num_threads: int | None = None,
+            mask: np.ndarray | None = None,
+            factor: int = 1,
+            cancel: CancelFlag | None = None) -> tuple:
+    """
+    whole analysis chain on a pyramid level
+
+    images: measured image stack
+    coefficients: accumulated fourier coefficients of images, optional
+    num_threads: number of analysis threads, all cores if None
+    mask: only masked pixels are analysed, optional
+    factor: downsampling of the result, 1 for full resolution
+    cancel: raises Cancelled between the stages once set, optional
+
+    returns modalities, inclination and tilts
+    """
+    stack = images.images
+
+    if factor > 1:
+        if coefficients is not None:
+            coefficients = epa.downsample(coefficients, factor)
+        else:
+            stack = epa.downsample(stack, factor)
+        if mask is not None:
+            mask = epa.downsample(mask, factor) > 0.5
+
+    background = None
+    if mask is not None:
+        if coefficients is not None:
+            coefficients = epa.pack(coefficients, mask)
+        else:
+            stack = epa.pack(stack, mask)
+        background = _background(stack, coefficients, num_threads)
+
+    _check(cancel)
+    modalities = _run_epa(stack, coefficients, num_threads)
+    _check(cancel)
+    incl = _run_calc_incl(modalities)
+    _check(cancel)
+    tilts = _run_tilting_simulation(modalities, incl, num_threads)
+    _check(cancel)
+    return _unpack(modalities, incl, tilts, mask, factor, images.shape[:2],
+                   background)
+
+
+def _background(stack, coefficients, num_threads):
+    """ results of a zero pixel, the value of masked out pixels """
+    if coefficients is not None:
+        coefficients = np.zeros_like(coefficients[:1])
+    stack = np.zeros_like(stack[:1])
+    modalities = _run_epa(stack, coefficients, num_threads)
+    # without retardation the pixel is steep and not white matter, the
+    # threshold of simple_incl needs a histogram of more pixels
+    incl = (np.full(1, np.pi / 2, modalities[2].dtype), np.zeros(1, bool))
+    tilts = _run_tilting_simulation(modalities, incl, num_threads)
+    return modalities, incl, tilts
+
+
+def _run_epa(stack, coefficients, num_threads):
+    if coefficients is not None:
+        # already accumulated while measuring, no pass over the stack
+        return epa.epa_from_coefficients(coefficients)
+    # fallback for bare stacks, e.g. a session without coefficients
+    return epa.epa_parallel(stack, num_threads)
+
+
+def _run_calc_incl(modalities):
+    return epa.simple_incl(modalities[0], modalities[2])
+
+
+def _run_tilting_simulation(modalities, incl, num_threads):
+    return epa.calc_tilts(*modalities, incl[0], num_threads)
+
+
+def _unpack(modalities, incl, tilts, mask, factor, shape, background=None):
+    tilts = list(tilts[1:])
+
+    if mask is not None:
+        # masked out pixels get the same values as in an unmasked analysis
+        fill_modalities, fill_incl, fill_tilts = background
+        modalities = [
+            epa.unpack(elm, mask, fill[0])
+            for elm, fill in zip(modalities, fill_modalities)
+        ]
+        incl = [
+            epa.unpack(elm, mask, fill[0])
+            for elm, fill in zip(incl, fill_incl)
+        ]
+        tilts = [
+            np.stack([
+                epa.unpack(elm, mask, value[0])
+                for elm, value in zip(tilt, fill)
+            ])
+            for tilt, fill in zip(tilts, fill_tilts[1:])
+        ]
+
+    if factor > 1:
+        modalities = [epa.upsample(elm, factor, shape) for elm in modalities]
+        incl = [epa.upsample(elm, factor, shape) for elm in incl]
+        tilts = [
+            np.stack([epa.upsample(elm, factor, shape)
+                      for elm in tilt])
+            for tilt in tilts
+        ]
+
+    # tilting does not change the transmittance
+    tilts = [np.broadcast_to(modalities[0], (4,) + tuple(shape))] + tilts
+
+    return (data_classes.Modalities(*modalities), data_classes.Incl(*incl),
+            tuple(tilts))
@@ -0,0 +1,88 @@
+"""
+On disk cache of probed camera capabilities
+
+Entries are keyed by the identity of the devices, so the cache becomes
+invalid as soon as a camera is plugged in, removed or moved to another port.
+Without a known identity, e.g. on windows, nothing is cached.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import typing
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'pli-demo',
+                          'capabilities.json')
+
+ABSENT = 'absent'  # identity of a port without a device
+
+
+def identity(port: int) -> str | None:
+    """ name and bus path of the video device of port, None if unknown """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    path = f'/sys/class/video4linux/video{port}'
+    if not os.path.exists(path):
+        return ABSENT
+    try:
+        with open(os.path.join(path, 'name'), 'r') as file:
+            name = file.read().strip()
+    except OSError:
+        return None
+    return f'{name}@{os.path.realpath(os.path.join(path, "device"))}'
+
+
+def capture_node(port: int) -> bool:
+    """
+    False for the additional nodes of a device, e.g. the metadata node of an
+    uvc camera, which never deliver frames
+    """
+    try:
+        with open(f'/sys/class/video4linux/video{port}/index', 'r') as file:
+            return int(file.read()) == 0
+    except (OSError, ValueError):
+        return True
+
+
+def ports_key(identities: dict) -> str | None:
+    """ key of the probed ports, None if none or any identity is unknown """
+    if not identities or any(value is None for value in identities.values()):
+        return None
+    return json.dumps(sorted(identities.items()))
+
+
+def _load(file_name: str) -> dict:
+    try:
+        with open(file_name, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def lookup(file_name: str | None, section: str,
+           key: str | None) -> typing.Any:
+    """ cached value, None if caching is disabled or nothing is cached """
+    if file_name is None or key is None:
+        return None
+    return _load(file_name).get(section, {}).get(key)
+
+
+def store(file_name: str | None, section: str, key: str | None,
+          value: typing.Any) -> None:
+    if file_name is None or key is None:
+        return
+
+    cache = _load(file_name)
+    cache.setdefault(section, {})[key] = value
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        # written completely or not at all, another instance could read it
+        with open(file_name + '.tmp', 'w') as file:
+            json.dump(cache, file, indent=2)
+        os.replace(file_name + '.tmp', file_name)
+    except OSError as error:
+        print(f'Warning: capabilities not cached: {error}')
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import concurrent.futures
 import enum
 import os
 import pathlib
@@ -8,7 +9,10 @@ import time
 import cv2
 import numpy as np
 
+from . import capabilities, grabber, video_source
+
 PATH = os.path.join(pathlib.Path().absolute(), 'data')
+PROBE_TIMEOUT = 5  # seconds, ports which need longer are considered broken
 
 # cv2 workaround
 # https://forum.qt.io/topic/119109/using-pyqt5-with-opencv-python-cv2-causes-error-could-not-load-qt-platform-plugin-xcb-even-though-it-was-found/23
@@ -43,14 +47,25 @@ class CapDev:
             port_list=range(5),
             properties=None,
             file_name=None,  # 'data/half_720p.mp4'
-            color_mode=Color.GREEN):
+            color_mode=Color.GREEN,
+            threaded=False,
+            buffer_size=8,
+            policy=grabber.Policy.LATEST,
+            cache_file=capabilities.CACHE_FILE):
 
         self._device = None
+        self._grabber = None
+        self._threaded = threaded
+        self._buffer_size = buffer_size
+        self._policy = policy
+        self._sequence = 0
+        self._last_frame = None
         self._port = port
         self._ports = []
         self._videos = []
         self._resolutions = []
         self._color_mode = color_mode
+        self._cache_file = cache_file
 
         # freeze class
         self.__freeze()
@@ -79,6 +94,8 @@ class CapDev:
 
     def _search_videos(self):
         print("searching for videos")
+        if not os.path.isdir(PATH):
+            return
         for file in os.listdir(PATH):
             if not os.path.isfile(os.path.join(PATH, file)):
                 continue
@@ -87,6 +104,7 @@ class CapDev:
             self._videos.append(os.path.join(PATH, file))
 
     def release_device(self):
+        self._stop_grabber()
         if self._device is not None:
             if self._device.isOpened():
                 self._device.release()
@@ -94,15 +112,40 @@ class CapDev:
 
     def activate_camera(self, port):
         self.release_device()
+        # cached ports are checked here, before their device is opened
         if self._check_port(port, n_times=10):
             self._device = cv2.VideoCapture(port)
+            self._port = port
+            self._start_grabber()
         else:
             print("Error: port is not working")
 
     def activate_video(self, file_name):
         self.release_device()
-        self._device = cv2.VideoCapture(file_name)
+        self._device = video_source.VideoSource(file_name, self._convert)
+        self._port = None
         # TODO: catch input error
+        self._start_grabber()
+
+    def _start_grabber(self):
+        """ reads the device in a thread if threaded """
+        self._sequence = 0
+        self._last_frame = None
+        if not self._threaded or self._device is None:
+            return
+
+        # video files are played with their frame rate, cameras are paced
+        # by their exposure
+        interval = 0
+        if self.get_frame_count():
+            interval = 1 / max(1, self._device.get(cv2.CAP_PROP_FPS))
+        self._grabber = grabber.Grabber(self._read, self._buffer_size,
+                                        self._policy, interval)
+
+    def _stop_grabber(self):
+        if self._grabber is not None:
+            self._grabber.stop()
+            self._grabber = None
 
     def _check_port(self, port, n_times):
         camera = cv2.VideoCapture(port)
@@ -117,19 +160,69 @@ class CapDev:
                 break
 
         print(f'Check Port {port}: {n} steps needed')
-        self.release_device()
         return port_works
 
     def _check_ports(self, port_list, n_times=1):
-        ports = [port for port in port_list if self._check_port(port, n_times)]
+        identities = {port: capabilities.identity(port) for port in port_list}
+        key = capabilities.ports_key(identities)
+
+        # only working ports are cached, a busy camera is probed again
+        cached = capabilities.lookup(self._cache_file, 'ports', key) or []
+        if cached:
+            print(f'INFO: cached ports: {cached}')
+        probed = self._probe_ports([
+            port for port, value in identities.items()
+            if value != capabilities.ABSENT and port not in cached and
+            capabilities.capture_node(port)
+        ], n_times)
+        ports = sorted(cached + probed)
+        if probed:
+            capabilities.store(self._cache_file, 'ports', key, ports)
+
         print(f"INFO: working ports: {ports}")
         return ports
 
-    def get_resolutions(self):
+    def _probe_ports(self, port_list, n_times):
+        """ working ports, which answered within PROBE_TIMEOUT """
+        if not port_list:
+            return []
+
+        pool = concurrent.futures.ThreadPoolExecutor(len(port_list))
+        futures = {
+            port: pool.submit(self._check_port, port, n_times)
+            for port in port_list
+        }
+        concurrent.futures.wait(futures.values(), PROBE_TIMEOUT)
+        # a hanging port can not be interrupted, its thread is left behind
+        pool.shutdown(wait=False)
+
+        for port, future in futures.items():
+            if not future.done():
+                print(f'Warning: port {port} did not answer in time')
+        ports = [
+            port for port, future in futures.items()
+            if future.done() and future.exception() is None and
+            future.result()
+        ]
+        return ports
+
+    def get_resolutions(self, rescan=False):
 
         if self._device is None:
             return None
 
+        key = None
+        if self._port is not None:
+            key = capabilities.identity(self._port)
+        if not rescan:
+            cached = capabilities.lookup(self._cache_file, 'resolutions', key)
+            if cached is not None:
+                self._resolutions = [tuple(elm) for elm in cached]
+                return self._resolutions
+
+        # the device is not shared with the grabber thread
+        self._stop_grabber()
+
         org_width = int(self._device.get(cv2.CAP_PROP_FRAME_WIDTH))
         org_height = int(self._device.get(cv2.CAP_PROP_FRAME_HEIGHT))
         org_fps = int(self._device.get(cv2.CAP_PROP_FPS))
@@ -170,6 +263,8 @@ class CapDev:
         self._resolutions = list(set(self._resolutions))
         self._resolutions.sort(key=lambda x: x[1])
         self._resolutions.sort(key=lambda x: x[0])
+        capabilities.store(self._cache_file, 'resolutions', key,
+                           self._resolutions)
 
         # reset to original
         self.set_prop(org_width, org_height, org_fps)
@@ -179,10 +274,18 @@ class CapDev:
     def get_fps(self):
         return int(self._device.get(cv2.CAP_PROP_FPS))
 
+    def get_frame_count(self):
+        """ number of frames of a video, 0 for cameras """
+        if self._device is None:
+            return 0
+        return int(self._device.get(cv2.CAP_PROP_FRAME_COUNT))
+
     def set_prop(self, width, height, fps=25):
         # reset camera to set setting before image capture
         # self.set_port(self._port)
 
+        self._stop_grabber()
+
         self._device.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         self._device.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
         self._device.set(cv2.CAP_PROP_FPS, fps)
@@ -194,22 +297,63 @@ class CapDev:
             print('INFO: trying to get image after setting options')
             time.sleep(0.42)
 
+        self._start_grabber()
+
     def empty_frame(self):
         frame = cv2.imread(os.path.join(PATH, 'pli-logo.png'))[:]
         return frame
 
-    def get_frame(self, quadratic=False) -> tuple[bool, np.ndarray]:
+    def _convert(self, frame: np.ndarray) -> np.ndarray:
+        """ contiguous frame in the color mode """
+        if self._color_mode in [Color.GRAY, Color.RGB]:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        elif self._color_mode is Color.RED:
+            frame = cv2.extractChannel(frame, 2)
+        elif self._color_mode is Color.GREEN:
+            frame = cv2.extractChannel(frame, 1)
+        elif self._color_mode is Color.BLUE:
+            frame = cv2.extractChannel(frame, 0)
+        return frame
+
+    def _read(self) -> tuple[bool, np.ndarray]:
+        """ next frame of the device in the color mode """
+        success, frame = self._device.read()
+        if not success:
+            return False, frame
+        if isinstance(self._device, video_source.VideoSource):
+            # converted and looped in the decoding thread
+            return True, frame
+        return True, self._convert(frame)
+
+    def last_frame(self) -> grabber.Frame | None:
+        """ sequence number, capture time and image of the last frame """
+        return self._last_frame
+
+    def dropped_frames(self) -> int:
+        """ frames the grabber thread read but get_frame never returned """
+        if self._grabber is None:
+            return 0
+        return self._grabber.dropped()
+
+    def get_frame(self,
+                  quadratic=False) -> tuple[bool, np.ndarray | None]:
+        """ frame is None if the grabber thread has no new frame yet """
 
         if self._device is None:
             return True, self.empty_frame()
 
-        # if video frame count > 0
-        video_frame_count = self._device.get(cv2.CAP_PROP_FRAME_COUNT)
-        if video_frame_count:
-            if video_frame_count == self._device.get(cv2.CAP_PROP_POS_FRAMES):
-                self._device.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-        success, frame = self._device.read()
+        if self._grabber is not None:
+            # the first frame of a device is waited for, afterwards the
+            # freshest frame is taken without blocking
+            last = self._grabber.get(1 if self._last_frame is None else 0)
+            if last is None and not self._grabber.failed():
+                # no new frame yet, a frame is never returned twice
+                return True, None
+            success = last is not None
+        else:
+            success, frame = self._read()
+            last = grabber.Frame(self._sequence, time.monotonic(), frame)
+            self._sequence += 1
 
         if not success:
             print('Error: camera disconnected')
@@ -221,14 +365,8 @@ class CapDev:
             self.release_device()
             return False, self.empty_frame()
 
-        if self._color_mode in [Color.GRAY, Color.RGB]:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        elif self._color_mode is Color.RED:
-            frame = frame[:, :, 2]
-        elif self._color_mode is Color.GREEN:
-            frame = frame[:, :, 1]
-        elif self._color_mode is Color.BLUE:
-            frame = frame[:, :, 0]
+        self._last_frame = last
+        frame = last.image
 
         if quadratic:
             height, width = frame.shape[0], frame.shape[1]
@@ -1,37 +1,112 @@
 from __future__ import annotations
 
 import dataclasses as dc
+import tempfile
+import typing
+import warnings
 
 import numpy as np
-import warnings
+
+
+def zeros(shape: tuple,
+          dtype: typing.Any,
+          scratch_dir: typing.Optional[str] = None) -> np.ndarray:
+    """ zero initialized array, memory mapped in scratch_dir if given """
+    if scratch_dir is None:
+        return np.zeros(shape, dtype)
+
+    # the file is removed on close, the memory map keeps its own handle
+    with tempfile.TemporaryFile(prefix='pli-', dir=scratch_dir) as file:
+        return np.memmap(file, dtype, 'w+', shape=tuple(shape))
+
+
+def no_frames(shape: tuple, dtype: typing.Any) -> np.ndarray:
+    """ read only zero (rho,x,y) frames of an (x,y,rho) shape without memory """
+    return np.broadcast_to(np.zeros((), dtype),
+                           (shape[-1],) + tuple(shape[:-1]))
 
 
 @dc.dataclass(frozen=True)
 class Images:
     # TODO: RFC, variables are instances and shared for all Images
-    shape: tuple
-
-    images: np.ndarray = dc.field(init=False)
+    shape: tuple  # (x, y, rho)
+    dtype: typing.Any = np.uint8  # uint16 for higher bit depth cameras
+    scratch_dir: typing.Optional[str] = None  # memory mapped frames if set
+
+    # existing frames, angles and valid flags can be passed, e.g. of a
+    # memory mapped session, otherwise they are allocated empty. They are
+    # never None after __post_init__.
+    frames: np.ndarray = None  # type: ignore[assignment]
+    angles: np.ndarray = None  # type: ignore[assignment]
+    valid: np.ndarray = None  # type: ignore[assignment]
     rotations: np.ndarray = dc.field(init=False)
-    valid: np.ndarray = dc.field(init=False)
 
     def __post_init__(self):
         # resetting np arrays with __setattr__ because of frozen
-        object.__setattr__(self, 'images', np.empty(self.shape))
+        # raw frames are stored contiguous frame by frame (rho, x, y)
+        if self.frames is None:
+            object.__setattr__(
+                self, 'frames',
+                zeros((self.shape[-1],) + tuple(self.shape[:-1]), self.dtype,
+                      self.scratch_dir))
         object.__setattr__(self, 'rotations',
                            np.linspace(0, np.pi, self.shape[-1], False))
-        object.__setattr__(self, 'valid', np.zeros_like(self.rotations,
-                                                        np.bool8))
-
-    def insert(self, image: np.ndarray, idx: int) -> None:
+        # measured rotation of each image, bin center if not available
+        if self.angles is None:
+            object.__setattr__(self, 'angles', self.rotations.copy())
+        if self.valid is None:
+            object.__setattr__(self, 'valid',
+                               np.zeros_like(self.rotations, np.bool8))
+
+    @property
+    def images(self) -> np.ndarray:
+        """ (x,y,rho)-view of the frames """
+        return np.moveaxis(self.frames, 0, -1)
+
+    def insert(self,
+               image: np.ndarray,
+               idx: int,
+               angle: typing.Optional[float] = None) -> None:
         if self.valid[idx]:
             warnings.warn('Already image present')
-
-        self.images[:, :, idx] = image
+        self.update(image, idx, angle)
+
+    def update(self,
+               image: np.ndarray,
+               idx: int,
+               angle: typing.Optional[float] = None) -> None:
+        """ overwrites the image of a bin, e.g. with a running mean """
+        self.frames[idx] = image
+        self.angles[idx] = self.rotations[idx] if angle is None else angle
         self.valid[idx] = True
 
+    def snapshot(self) -> Images:
+        """ read only copy, independent of later inserts """
+        frames = zeros(self.frames.shape, self.frames.dtype, self.scratch_dir)
+        frames[:] = self.frames
+        angles = self.angles.copy()
+        valid = self.valid.copy()
+        for array in (frames, angles, valid):
+            array.flags.writeable = False
+        return dc.replace(self, frames=frames, angles=angles, valid=valid)
+
+    def layout(self) -> Images:
+        """
+        read only copy of angles and valid flags, the frames are not copied,
+        e.g. for an analysis of accumulated coefficients
+        """
+        angles = self.angles.copy()
+        valid = self.valid.copy()
+        angles.flags.writeable = False
+        valid.flags.writeable = False
+        return dc.replace(self,
+                          frames=no_frames(self.shape, self.dtype),
+                          angles=angles,
+                          valid=valid)
+
     def stack(self):
-        return self.rotations[self.valid], self.images[:, :, self.valid]
+        """ measured rotations and images of all valid bins """
+        return self.angles[self.valid], self.images[:, :, self.valid]
 
 
 @dc.dataclass(frozen=True)
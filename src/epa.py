@@ -5,9 +5,11 @@ Analyse Methods for PLI signals
 
 from __future__ import annotations
 
+import contextlib
+import functools
+
 import numba
 import numpy as np
-import colorsys
 
 
 def rot_x(phi: float) -> np.ndarray:
@@ -28,7 +30,351 @@ def rot_z(phi: float) -> np.ndarray:
                      (np.sin(phi), np.cos(phi), 0), (0, 0, 1)), float)
 
 
-def epa(data: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+# number of pixels reduced per BLAS call, bounds the float temporaries
+_CHUNK_SIZE = 2**16
+
+# maximal condition number of the normal equations for least squares, which
+# corresponds to rotations spread over at least 90 degree
+_MAX_CONDITION = 25
+
+# number of pixels per tile of the fused epa kernel
+_TILE_SIZE = 2048
+
+
+def _compute_dtype(data: np.ndarray) -> np.dtype:
+    return np.dtype(np.float32 if data.itemsize <= 4 else np.float64)
+
+
+@functools.lru_cache(maxsize=None)
+def _fourier_basis(n: int, dtype: np.dtype) -> np.ndarray:
+    """
+    (n,3)-array mapping a rho series onto its fourier coefficients a0, a1, b1
+
+    rho index must be equidistance between [0,180) degree
+    """
+    rho_2 = 2 * np.linspace(0, np.pi, n, False, dtype=dtype)
+
+    basis = np.empty((n, 3), dtype)
+    basis[:, 0] = 1 / n
+    basis[:, 1] = 2 * np.sin(rho_2) / n
+    basis[:, 2] = 2 * np.cos(rho_2) / n
+    basis.flags.writeable = False
+    return basis
+
+
+def _pixels(data: np.ndarray) -> np.ndarray:
+    """ (p,rho)-view of a (...,rho)-array, frame major stacks are not copied """
+    n = data.shape[-1]
+    frames = np.moveaxis(data, -1, 0)
+    if frames.flags.c_contiguous and not data.flags.c_contiguous:
+        return frames.reshape(n, -1).T
+    return data.reshape(-1, n)
+
+
+def _contract(data: np.ndarray, basis: np.ndarray,
+              out: np.ndarray | None) -> np.ndarray:
+    dtype = basis.dtype
+
+    if out is None:
+        out = np.empty(data.shape[:-1] + (3,), dtype)
+    elif out.shape != data.shape[:-1] + (3,) or not out.flags.c_contiguous:
+        raise ValueError('out has to be a c-contiguous (x,y,3)-array')
+
+    # single contraction per chunk, uint8 input is only casted chunk wise
+    pixels = _pixels(data)
+    coefficients = out.reshape(-1, 3)
+    for i in range(0, pixels.shape[0], _CHUNK_SIZE):
+        chunk = pixels[i:i + _CHUNK_SIZE]
+        if chunk.dtype != dtype:
+            chunk = chunk.astype(dtype)
+        np.matmul(chunk, basis, out=coefficients[i:i + _CHUNK_SIZE])
+
+    return out
+
+
+def fourier_coefficients(data: np.ndarray,
+                         out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Calculates the fourier coefficients of a PLI image sequence
+
+    Parameters
+    ----------
+    data : (x,y,rho)-array_like
+        rho index must be equidistance between [0,180) degree, memory mapped
+        stacks are read in streaming chunks
+    out : (x,y,3)-array, optional
+        c-contiguous array the coefficients are written into
+
+    Returns
+    -------
+    res : (x,y,3)-array
+        a0, a1, b1
+    """
+
+    data = np.asarray(data)
+    basis = _fourier_basis(data.shape[-1], _compute_dtype(data))
+    return _contract(data, basis, out)
+
+
+def _design_matrix(rho: np.ndarray | tuple | float) -> np.ndarray:
+    """ (m,3)-array of the PLI signal model 1, sin(2 rho), cos(2 rho) """
+    rho_2 = 2 * np.asarray(rho, np.float64)
+    return np.stack((np.ones_like(rho_2), np.sin(rho_2), np.cos(rho_2)), -1)
+
+
+def _gram(rho: np.ndarray) -> np.ndarray:
+    design = _design_matrix(rho)
+    return design.T @ design
+
+
+def well_spread(rho: np.ndarray,
+                max_condition: float = _MAX_CONDITION) -> bool:
+    """
+    Checks if the signal model can be fitted to a set of rotations
+
+    Parameters
+    ----------
+    rho : (m)-array_like
+        rotation angles in radian
+    max_condition : float
+        maximal condition number of the normal equations
+
+    Returns
+    -------
+    res : bool
+    """
+
+    rho = np.asarray(rho)
+    if rho.size < 3:
+        return False
+    return well_conditioned(_gram(rho), max_condition)
+
+
+def well_conditioned(gram: np.ndarray,
+                     max_condition: float = _MAX_CONDITION) -> bool:
+    """
+    Checks if accumulated normal equations can be solved
+
+    Parameters
+    ----------
+    gram : (3,3)-array
+    max_condition : float
+        maximal condition number of the normal equations
+
+    Returns
+    -------
+    res : bool
+    """
+
+    return bool(np.linalg.cond(gram) <= max_condition)
+
+
+@functools.lru_cache(maxsize=32)
+def _lstsq_basis(rho: tuple, dtype: np.dtype) -> np.ndarray:
+    """
+    (m,3)-array mapping a rho series onto its least squares coefficients
+    a0, a1, b1, i.e. the transposed pseudo inverse of the design matrix
+    """
+    design = _design_matrix(rho)
+    basis = np.linalg.solve(design.T @ design, design.T).T.astype(dtype)
+    basis.flags.writeable = False
+    return basis
+
+
+def lstsq_coefficients(data: np.ndarray,
+                       rho: np.ndarray,
+                       out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Fits the fourier coefficients of a PLI image sequence with arbitrary
+    rotation angles
+
+    Parameters
+    ----------
+    data : (x,y,m)-array_like
+    rho : (m)-array_like
+        rotation angle of each image in radian, has to be well spread
+    out : (x,y,3)-array, optional
+        c-contiguous array the coefficients are written into
+
+    Returns
+    -------
+    res : (x,y,3)-array
+        a0, a1, b1
+    """
+
+    data = np.asarray(data)
+    rho = np.asarray(rho, np.float64).ravel()
+    if rho.size != data.shape[-1]:
+        raise ValueError('number of rotations differs from data')
+    if not well_spread(rho):
+        raise ValueError('rotations are not well spread')
+
+    basis = _lstsq_basis(tuple(rho), _compute_dtype(data))
+    return _contract(data, basis, out)
+
+
+def accumulate_normal_equations(sums: np.ndarray, gram: np.ndarray,
+                                image: np.ndarray,
+                                rho: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Adds a single image with arbitrary rotation angle to the normal
+    equations of the PLI signal model
+
+    Parameters
+    ----------
+    sums : (x,y,3)-array
+        running sums of image * (1, sin(2 rho), cos(2 rho)), updated inplace
+    gram : (3,3)-array
+        running gram matrix of the design matrix, updated inplace
+    image : (x,y)-array
+    rho : float
+        rotation angle of the image in radian
+
+    Returns
+    -------
+    res : sums, gram
+    """
+
+    row = _design_matrix(rho)
+    sums += image[..., None] * row.astype(sums.dtype)
+    gram += np.outer(row, row)
+    return sums, gram
+
+
+def solve_normal_equations(sums: np.ndarray,
+                           gram: np.ndarray,
+                           out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Solves the accumulated normal equations of the PLI signal model
+
+    Parameters
+    ----------
+    sums : (x,y,3)-array
+    gram : (3,3)-array
+    out : (x,y,3)-array, optional
+
+    Returns
+    -------
+    res : (x,y,3)-array
+        a0, a1, b1
+    """
+
+    if not well_conditioned(gram):
+        raise ValueError('rotations are not well spread')
+
+    # gram is symmetric, therefore sums @ inv(gram).T == sums @ inv(gram)
+    return np.matmul(sums, np.linalg.inv(gram).astype(sums.dtype), out=out)
+
+
+def accumulate_coefficients(coefficients: np.ndarray, image: np.ndarray,
+                            index: int, n: int) -> np.ndarray:
+    """
+    Adds a single image of a PLI image sequence to its fourier coefficients
+
+    Parameters
+    ----------
+    coefficients : (x,y,3)-array
+        running a0, a1, b1, updated inplace
+    image : (x,y)-array
+        image at rho index of the sequence
+    index : int
+        rho index of the image
+    n : int
+        length of the sequence, rho equidistance between [0,180) degree
+
+    Returns
+    -------
+    res : (x,y,3)-array
+        coefficients
+    """
+
+    basis = _fourier_basis(n, coefficients.dtype)
+    coefficients += image[..., None] * basis[index]
+    return coefficients
+
+
+def accumulate_moments(mean: np.ndarray, m2: np.ndarray, image: np.ndarray,
+                       count: int) -> np.ndarray:
+    """
+    Adds an image to the running mean and squared deviations of its rotation
+    bin (Welford)
+
+    Parameters
+    ----------
+    mean : (x,y)-array
+        running mean of the bin, updated inplace
+    m2 : (x,y)-array
+        running sum of squared deviations from the mean, updated inplace
+    image : (x,y)-array
+    count : int
+        number of images in the bin, including this one
+
+    Returns
+    -------
+    res : (x,y)-array
+        change of the mean, e.g. to update the fourier coefficients
+    """
+
+    delta = image - mean
+    change = delta / count
+    mean += change
+    m2 += delta * (image - mean)
+    return change
+
+
+def _direction(a1: np.ndarray, b1: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # d = 0.5 * np.arctan2(-b1, a1) + np.pi; d = d % np.pi
+    np.negative(b1, out=out)
+    np.arctan2(out, a1, out=out)
+    out *= 0.5
+    out += np.pi
+    np.mod(out, np.pi, out=out)
+
+    # TODO: d = 0.5 * np.arctan2(a1, -b1) + np.pi without d = d % np.pi
+
+    return out
+
+
+def epa_from_coefficients(
+    coefficients: np.ndarray,
+    out: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates modalities from the fourier coefficients of a PLI signal
+
+    Parameters
+    ----------
+    coefficients : (x,y,3)-array
+        a0, a1, b1
+    out : tuple of three (x,y)-arrays, optional
+        preallocated transmittance, direction, retardation
+
+    Returns
+    -------
+    res : transmittance, direction, retardation
+    """
+
+    a0 = coefficients[..., 0]
+    a1 = coefficients[..., 1]
+    b1 = coefficients[..., 2]
+
+    if out is None:
+        t, d, r = (np.empty(a0.shape, coefficients.dtype) for _ in range(3))
+    else:
+        t, d, r = out
+
+    np.multiply(a0, 2, out=t)
+    _direction(a1, b1, d)
+    np.hypot(a1, b1, out=r)
+    r /= a0 + 1e-16
+
+    return t, d, r
+
+
+def epa(
+    data: np.ndarray,
+    out: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     Calculates modalities for a PLI image sequence
 
@@ -36,34 +382,156 @@ def epa(data: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     ----------
     data : (x,y,rho)-array_like
         rho index must be equidistance between [0,180) degree
+    out : tuple of three (x,y)-arrays, optional
+        preallocated transmittance, direction, retardation
 
     Returns
     -------
     res : transmittance, direction, retardation
     """
 
-    data = np.array(data, copy=False)
-    n = data.shape[-1]
+    return epa_from_coefficients(fourier_coefficients(data), out)
 
-    dtype = np.float32 if data.itemsize <= 4 else np.float64
-    rho_2 = 2 * np.linspace(0, np.pi, n, False, dtype=dtype)
 
-    a0 = np.sum(data, -1) / n
-    a1 = 2 * np.sum(data * np.sin(rho_2), -1) / n
-    b1 = 2 * np.sum(data * np.cos(rho_2), -1) / n
+def epa_lstsq(
+    data: np.ndarray,
+    rho: np.ndarray,
+    out: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates modalities for a PLI image sequence with arbitrary rotations
+
+    Parameters
+    ----------
+    data : (x,y,m)-array_like
+    rho : (m)-array_like
+        rotation angle of each image in radian, has to be well spread
+    out : tuple of three (x,y)-arrays, optional
+        preallocated transmittance, direction, retardation
+
+    Returns
+    -------
+    res : transmittance, direction, retardation
+    """
 
-    t = 2 * a0
-    d = 0.5 * np.arctan2(-b1, a1) + np.pi
-    r = np.sqrt(a1 * a1 + b1 * b1) / (a0 + 1e-16)
+    return epa_from_coefficients(lstsq_coefficients(data, rho), out)
+
+
+@contextlib.contextmanager
+def _numba_threads(num_threads: int | None):
+    """ limits the numba threads, all cores if None """
+    if num_threads is None:
+        num_threads = numba.config.NUMBA_NUM_THREADS
+    num_threads = max(1, min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+    # numba thread count is local to the calling thread
+    previous = numba.get_num_threads()
+    numba.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        numba.set_num_threads(previous)
+
+
+@numba.njit(parallel=True, cache=True, fastmath=True)
+def _epa_fused(data: np.ndarray, basis: np.ndarray, tile_size: int,
+               t: np.ndarray, a1_out: np.ndarray, b1_out: np.ndarray,
+               r: np.ndarray) -> None:
+    num_pixels, n = data.shape
+    basis_t = np.ascontiguousarray(basis.T)
+    frame_major = data.strides[0] < data.strides[1]
+    num_tiles = (num_pixels + tile_size - 1) // tile_size
+    for tile in numba.prange(num_tiles):
+        start = tile * tile_size
+        size = min(num_pixels - start, tile_size)
+        # accumulated in the compute dtype, e.g. float32 for uint8 stacks
+        a0 = np.zeros(size, basis.dtype)
+        a1 = np.zeros(size, basis.dtype)
+        b1 = np.zeros(size, basis.dtype)
+        if frame_major:
+            # contiguous rows of the frames, vectorized over the pixels
+            for k in range(n):
+                c0 = basis[k, 0]
+                c1 = basis[k, 1]
+                c2 = basis[k, 2]
+                for j in range(size):
+                    value = data[start + j, k]
+                    a0[j] += value * c0
+                    a1[j] += value * c1
+                    b1[j] += value * c2
+        else:
+            for j in range(size):
+                s0 = a0[j]
+                s1 = a1[j]
+                s2 = b1[j]
+                for k in range(n):
+                    value = data[start + j, k]
+                    s0 += value * basis_t[0, k]
+                    s1 += value * basis_t[1, k]
+                    s2 += value * basis_t[2, k]
+                a0[j] = s0
+                a1[j] = s1
+                b1[j] = s2
+
+        for j in range(size):
+            i = start + j
+            t[i] = 2 * a0[j]
+            a1_out[i] = a1[j]
+            b1_out[i] = b1[j]
+            r[i] = np.sqrt(a1[j] * a1[j] + b1[j] * b1[j]) / (a0[j] + 1e-16)
+
+
+def epa_parallel(
+    data: np.ndarray,
+    num_threads: int | None = None,
+    out: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None,
+    tile_size: int = _TILE_SIZE
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculates modalities for a PLI image sequence with a fused multi-core
+    kernel, each tile of pixels is reduced in a single pass
 
-    d = d % np.pi
+    The direction is computed afterwards with the vectorized arctan2 of numpy,
+    which is much faster than the scalar one of numba.
 
-    # TODO: d = 0.5 * np.arctan2(a1, -b1) + np.pi without d = d % np.pi
+    Parameters
+    ----------
+    data : (...,rho)-array_like
+        rho index must be equidistance between [0,180) degree
+    num_threads : int, optional
+        number of threads, all cores if None
+    out : tuple of three c-contiguous (...)-arrays, optional
+        preallocated transmittance, direction, retardation
+    tile_size : int
+        number of pixels per tile
+
+    Returns
+    -------
+    res : transmittance, direction, retardation
+    """
+
+    data = np.asarray(data)
+    dtype = _compute_dtype(data)
+    basis = _fourier_basis(data.shape[-1], dtype)
+
+    if out is None:
+        t, d, r = (np.empty(data.shape[:-1], dtype) for _ in range(3))
+    elif any(not elm.flags.c_contiguous for elm in out):
+        raise ValueError('out has to be c-contiguous')
+    else:
+        t, d, r = out
+    a1 = np.empty(data.shape[:-1], dtype)
+
+    # b1 is written into the direction
+    with _numba_threads(num_threads):
+        _epa_fused(_pixels(data), basis, tile_size, t.reshape(-1),
+                   a1.reshape(-1), d.reshape(-1), r.reshape(-1))
+    _direction(a1, d, d)
 
     return t, d, r
 
 
-def direction(data: np.ndarray) -> np.ndarray:
+def direction(data: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
     """
     Calculates direction map for a PLI image sequence
 
@@ -71,30 +539,112 @@ def direction(data: np.ndarray) -> np.ndarray:
     ----------
     data : array_like
         (x,y,rho)-array, rho index must be equidistance between [0,180) degree
+    out : (x,y)-array, optional
+        preallocated direction
 
     Returns
     -------
     res : direction
     """
 
-    data = np.array(data, copy=False)
-    n = data.shape[-1]
+    coefficients = fourier_coefficients(data)
+    if out is None:
+        out = np.empty(coefficients.shape[:-1], coefficients.dtype)
 
-    dtype = np.float32 if data.itemsize <= 4 else np.float64
-    rho_2 = 2 * np.linspace(0, np.pi, n, False, dtype=dtype)
+    return _direction(coefficients[..., 1], coefficients[..., 2], out)
 
-    a1 = 2 * np.sum(data * np.sin(rho_2), -1) / n
-    b1 = 2 * np.sum(data * np.cos(rho_2), -1) / n
 
-    d = 0.5 * np.arctan2(-b1, a1) + np.pi
+def pack(data: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Packs the masked pixels into a compact array
 
-    d = d % np.pi
+    Parameters
+    ----------
+    data : (x,y,...)-array
+    mask : (x,y)-bool array
 
-    return d
+    Returns
+    -------
+    res : (m,...)-array
+        m number of masked pixels
+    """
+
+    return np.asarray(data)[np.asarray(mask, bool)]
+
+
+def unpack(values: np.ndarray,
+           mask: np.ndarray,
+           fill: float = 0,
+           out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Scatters packed pixels back into their image
+
+    Parameters
+    ----------
+    values : (m,...)-array
+    mask : (x,y)-bool array
+    fill : float
+        value of unmasked pixels
+    out : (x,y,...)-array, optional
+
+    Returns
+    -------
+    res : (x,y,...)-array
+    """
+
+    mask = np.asarray(mask, bool)
+    if out is None:
+        out = np.empty(mask.shape + values.shape[1:], values.dtype)
+    out[~mask] = fill
+    out[mask] = values
+    return out
+
+
+def downsample(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Block mean over the first two axes, incomplete border blocks are dropped
+
+    Parameters
+    ----------
+    data : (x,y,...)-array
+    factor : int
+
+    Returns
+    -------
+    res : (x//factor,y//factor,...)-array
+    """
+
+    data = np.asarray(data)
+    x, y = data.shape[0] // factor, data.shape[1] // factor
+    blocks = data[:x * factor, :y * factor].reshape((x, factor, y, factor) +
+                                                    data.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+
+def upsample(data: np.ndarray, factor: int, shape: tuple) -> np.ndarray:
+    """
+    Nearest neighbour counterpart of downsample, border is filled with edges
+
+    Parameters
+    ----------
+    data : (x,y,...)-array
+    factor : int
+    shape : (x,y)-tuple
+        shape of the original data
+
+    Returns
+    -------
+    res : (shape[0],shape[1],...)-array
+    """
+
+    data = np.repeat(np.repeat(data, factor, axis=0), factor, axis=1)
+    pad = [(0, shape[0] - data.shape[0]), (0, shape[1] - data.shape[1])]
+    pad += [(0, 0)] * (data.ndim - 2)
+    return np.pad(data, pad, mode='edge')
 
 
 def simple_incl(transmittance: np.ndarray,
-                retardation: np.ndarray) -> np.ndarray:
+                retardation: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
 
     # ret>1 detected, probably hand movement in front of the camera
     hist, edges = np.histogram(retardation[retardation <= 1], 42)
@@ -108,70 +658,183 @@ def simple_incl(transmittance: np.ndarray,
     return inclination, wm_mask
 
 
-def fom(direction: np.ndarray, inclination: np.ndarray) -> np.ndarray:
-    # todo check with numba
-    hsv_to_rgb_v = np.vectorize(colorsys.hsv_to_rgb)
-    fom = np.dstack(
-        hsv_to_rgb_v(direction / np.pi, np.ones_like(direction),
-                     1 - (inclination / np.pi * 2)))
-    return fom
+def _hsv_to_rgb(hue: np.ndarray, value: np.ndarray) -> np.ndarray:
+    """ vectorized colorsys.hsv_to_rgb for saturation 1 -> (...,3) uint8 """
+    hue, value = np.broadcast_arrays(np.asarray(hue, np.float32),
+                                     np.clip(value, 0, 1).astype(np.float32))
+
+    rgb = np.empty(hue.shape + (3,), np.uint8)
+    for c, n in enumerate((5, 3, 1)):
+        k = n + hue * 6
+        k %= 6
+        k = np.minimum(k, 4 - k)
+        np.clip(k, 0, 1, out=k)
+        k = 1 - k
+        k *= value
+        k *= 255
+        rgb[..., c] = k
+    return rgb
+
+
+@functools.lru_cache(maxsize=None)
+def _fom_lut(num_direction: int, num_inclination: int) -> np.ndarray:
+    """ (direction, inclination, 3)-uint8 array sampled at bin centers """
+    direction = (np.arange(num_direction) + 0.5) * np.pi / num_direction
+    inclination = np.linspace(0, np.pi / 2, num_inclination)
+    lut = fom(direction[:, None], inclination[None, :])
+    lut.flags.writeable = False
+    return lut
+
+
+def fom(direction: np.ndarray,
+        inclination: np.ndarray,
+        lut: bool = False,
+        num_direction: int = 360,
+        num_inclination: int = 256) -> np.ndarray:
+    """
+    Calculates the fiber orientation map, hsv color coded
 
+    Parameters
+    ----------
+    direction : (x,y)-array
+        [0, pi) -> hue
+    inclination : (x,y)-array
+        [0, pi/2] -> value
+    lut : bool
+        gather colors from a precomputed lookup table of quantized direction
+        and inclination instead of evaluating them
+    num_direction, num_inclination : int
+        lookup table size
+
+    Returns
+    -------
+    res : (x,y,3)-uint8 array
+    """
 
-@numba.njit(cache=True)
-def _calc_tilt(x: np.ndarray, y: np.ndarray, z: np.ndarray, rho: float,
-               rot: np.ndarray) -> np.ndarray:
-    data = np.zeros((x.shape[0], x.shape[1], rho.size))
-    incl = np.zeros((x.shape[0], x.shape[1]))
-    for i in range(x.shape[0]):
+    if not lut:
+        return _hsv_to_rgb(direction / np.pi, 1 - (inclination / np.pi * 2))
+
+    table = _fom_lut(num_direction, num_inclination)
+    i = (direction * (num_direction / np.pi)).astype(np.intp)
+    i %= num_direction
+    j = np.rint(
+        np.clip(inclination, 0, np.pi / 2) *
+        ((num_inclination - 1) / (np.pi / 2))).astype(np.intp)
+    return table[i, j]
+
+
+@numba.njit(parallel=True, cache=True)
+def _calc_tilt(x: np.ndarray, y: np.ndarray, z: np.ndarray,
+               rot: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    direction = np.empty(x.shape)
+    retardation = np.empty(x.shape)
+    incl = np.empty(x.shape)
+    for i in numba.prange(x.shape[0]):
         for j in range(x.shape[1]):
             # if not mask[i, j]:
             #     continue
-            v = np.dot(rot, np.array([x[i, j], y[i, j], z[i, j]]))
-            a = np.pi / 2 - np.arccos(v[2])
-            p = np.arctan2(v[1], v[0])
+            v0 = rot[0, 0] * x[i, j] + rot[0, 1] * y[i, j] + rot[0, 2] * z[i, j]
+            v1 = rot[1, 0] * x[i, j] + rot[1, 1] * y[i, j] + rot[1, 2] * z[i, j]
+            v2 = rot[2, 0] * x[i, j] + rot[2, 1] * y[i, j] + rot[2, 2] * z[i, j]
+            a = np.pi / 2 - np.arccos(min(1.0, max(-1.0, v2)))
+            p = np.arctan2(v1, v0)
 
             # 0.6 experience value for wupperthaler section
             # and yes THIS IS WRONG
             delta = 0.6 * np.cos(a)**2
-            data[i, j, :] = (1 + np.sin(2 * (rho - p)) * np.sin(delta))
 
+            # closed form epa of 1 + sin(2 * (rho - p)) * sin(delta)
+            direction[i, j] = p % np.pi
+            retardation[i, j] = np.sin(delta)
             incl[i, j] = a
-    return data, incl
+    return direction, retardation, incl
 
 
-def calc_tilts(transmittance: np.ndarray, direction: np.ndarray,
-               retardation: np.ndarray, inclination: np.ndarray,
-               N: int) -> np.ndarray:
+def calc_tilts(
+    transmittance: np.ndarray,
+    direction: np.ndarray,
+    retardation: np.ndarray,
+    inclination: np.ndarray,
+    num_threads: int | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Simulates the modalities of a tilted measurement, 10 degree towards
+    north, east, south and west
+
+    Parameters
+    ----------
+    transmittance, direction, retardation, inclination : (x,y)- or (m)-array
+    num_threads : int, optional
+        number of threads, all cores if None
+
+    Returns
+    -------
+    res : transmittance, direction, retardation, inclination
+        (4,x,y)- or (4,m)-arrays, the transmittance is a read only view
+    """
+
+    # packed (m)-arrays are processed as (m,1)-arrays
+    shape = transmittance.shape
+    inclination = inclination.reshape(shape[0], -1)
+    direction = direction.reshape(shape[0], -1)
 
-    # TODO: speedup
-    tilt_frames = []
     x = np.cos(inclination) * np.cos(direction)
     y = np.cos(inclination) * np.sin(direction)
     z = np.sin(inclination)
 
     theta = np.deg2rad(10)
 
-    tilt_frames = np.empty(
-        (4, transmittance.shape[0], transmittance.shape[1], N))
-    tilt_transmittance = np.empty(
-        (4, transmittance.shape[0], transmittance.shape[1]))
-    tilt_direction = np.empty(
-        (4, transmittance.shape[0], transmittance.shape[1]))
-    tilt_retardation = np.empty(
-        (4, transmittance.shape[0], transmittance.shape[1]))
-    tilt_inclination = np.empty(
-        (4, transmittance.shape[0], transmittance.shape[1]))
-
-    rho = np.linspace(0, np.pi, N, endpoint=False, dtype=x.dtype)
-    for r, phi in enumerate([0, 90, 180, 270]):
-        rot = np.dot(rot_z(-phi), np.dot(rot_x(theta),
-                                         rot_z(phi))).astype(x.dtype)
-
-        frames, tilt_inclination[r] = _calc_tilt(x, y, z, rho, rot)
-        tilt_frames[r] = (frames * transmittance[:, :, None] / 2).astype(
-            np.uint8)
-
-    for i, data in enumerate(tilt_frames):
-        tilt_transmittance[i], tilt_direction[i], tilt_retardation[i] = epa(
-            data)
-    return tilt_frames, tilt_transmittance, tilt_direction, tilt_retardation, tilt_inclination
+    tilt_transmittance = np.broadcast_to(transmittance, (4,) + shape)
+    tilt_direction = np.empty((4,) + x.shape)
+    tilt_retardation = np.empty((4,) + x.shape)
+    tilt_inclination = np.empty((4,) + x.shape)
+
+    with _numba_threads(num_threads):
+        for r, phi in enumerate([0, 90, 180, 270]):
+            rot = np.dot(rot_z(-phi), np.dot(rot_x(theta), rot_z(phi)))
+            tilt_direction[r], tilt_retardation[r], tilt_inclination[
+                r] = _calc_tilt(x, y, z, rot)
+
+    tilt_direction.shape = (4,) + shape
+    tilt_retardation.shape = (4,) + shape
+    tilt_inclination.shape = (4,) + shape
+
+    return tilt_transmittance, tilt_direction, tilt_retardation, tilt_inclination
+
+
+def tilt_images(transmittance: np.ndarray,
+                direction: np.ndarray,
+                retardation: np.ndarray,
+                N: int,
+                out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Synthesizes the PLI image sequence of (tilted) modalities
+
+    Parameters
+    ----------
+    transmittance, direction, retardation : (x,y)-array
+    N : int
+        number of equidistance rotations between [0,180) degree
+    out : (N,x,y)-uint8 array, optional
+        frame major buffer, e.g. memory mapped
+
+    Returns
+    -------
+    res : (x,y,N)-uint8 array
+        view of out
+    """
+
+    if out is None:
+        out = np.empty((N,) + transmittance.shape, np.uint8)
+
+    # frame by frame, only a single frame is held as float
+    amplitude = transmittance / 2
+    for i, rho in enumerate(np.linspace(0, np.pi, N, endpoint=False)):
+        frame = rho - direction
+        frame *= 2
+        np.sin(frame, out=frame)
+        frame *= retardation
+        frame += 1
+        frame *= amplitude
+        out[i] = frame
+    return np.moveaxis(out, 0, -1)
@@ -0,0 +1,40 @@
+"""
+Writes measurements and their results to image files, independent of any gui
+"""
+
+from __future__ import annotations
+
+import os
+
+import numpy as np
+import PIL.Image
+
+FILES = [
+    'rotations.txt', 'stack.tif', 'transmittance.tif', 'direction.tif',
+    'retardation.tif', 'wm_mask.tif', 'inclination.tif', 'fom.tif'
+]
+
+
+def write_images(path: str, pli, tracker, tilt: str = 'center') -> None:
+    """
+    path: existing directory, files are overwritten
+    pli: analysed measurement
+    tracker: calibrated tracker, images are placed into the full frame
+    tilt: tilting of the image stack
+    """
+    np.savetxt(os.path.join(path, 'rotations.txt'), pli.rotations())
+    stack = []
+    data = np.moveaxis(pli.images(tilt), -1, 0)
+    for img in data:
+        # the full frame of the tracker is reused
+        stack.append(PIL.Image.fromarray(tracker.rev_crop_img(img).copy()))
+    stack[0].save(os.path.join(path, 'stack.tif'),
+                  save_all=True,
+                  append_images=stack[1:])
+
+    for name in [
+            'transmittance', 'direction', 'retardation', 'wm_mask',
+            'inclination', 'fom'
+    ]:
+        img = PIL.Image.fromarray(tracker.rev_crop_img(getattr(pli, name)()))
+        img.save(os.path.join(path, f'{name}.tif'))
@@ -0,0 +1,143 @@
+"""
+Background reading of frames into a bounded ring buffer
+
+The consumer, e.g. the gui timer, never waits for the camera or the decoder.
+"""
+
+from __future__ import annotations
+
+import collections
+import enum
+import threading
+import time
+import typing
+
+import numpy as np
+
+
+@enum.unique
+class Policy(enum.Enum):
+    LATEST = enum.auto()  # old frames are dropped, the freshest is delivered
+    ALL = enum.auto()  # every frame is delivered, the reader waits if full
+
+
+class Frame(typing.NamedTuple):
+    sequence: int  # number of the frame since the device was activated
+    timestamp: float  # time.monotonic() when the frame was read
+    image: np.ndarray
+
+
+class Grabber:
+    """
+    reads frames with read() in a thread until stop() or a failed read
+
+    read: callable returning (success, image) like cv2.VideoCapture.read
+    interval: minimal seconds between two reads, e.g. to play a video file
+        with its frame rate
+    """
+
+    __is_frozen = False
+
+    def __setattr__(self, key, value):
+        if self.__is_frozen and not hasattr(self, key):
+            raise TypeError('%r is a frozen class' % self)
+        object.__setattr__(self, key, value)
+
+    def __freeze(self):
+        self.__is_frozen = True
+
+    def __init__(self,
+                 read: typing.Callable[[], tuple[bool, np.ndarray]],
+                 size: int = 8,
+                 policy: Policy = Policy.LATEST,
+                 interval: float = 0):
+        self._read = read
+        self._policy = policy
+        self._interval = interval
+        self._buffer: collections.deque[Frame] = collections.deque(
+            maxlen=max(1, size))
+        self._condition = threading.Condition()
+        self._running = True
+        self._failed = False
+        self._sequence = 0
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name='grabber',
+                                        daemon=True)
+
+        # freeze class
+        self.__freeze()
+
+        self._thread.start()
+
+    def _run(self):
+        next_read = time.monotonic()
+        while self._running:
+            if self._interval:
+                delay = next_read - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_read = max(next_read + self._interval, time.monotonic())
+
+            success, image = self._read()
+            timestamp = time.monotonic()
+
+            with self._condition:
+                if not success:
+                    self._failed = True
+                    self._condition.notify_all()
+                    return
+
+                if self._policy is Policy.ALL:
+                    self._condition.wait_for(
+                        lambda: len(self._buffer) < self._buffer.maxlen or
+                        not self._running)
+                    if not self._running:
+                        return
+                elif len(self._buffer) == self._buffer.maxlen:
+                    self._dropped += 1
+
+                self._buffer.append(Frame(self._sequence, timestamp, image))
+                self._sequence += 1
+                self._condition.notify_all()
+
+    def get(self, timeout: float = 0) -> Frame | None:
+        """
+        freshest frame (LATEST) or oldest unread frame (ALL)
+
+        None if no new frame arrived within timeout, a frame is never
+        delivered twice. After a failed read the remaining frames are still
+        delivered, see failed().
+        """
+        with self._condition:
+            if timeout > 0:
+                self._condition.wait_for(
+                    lambda: self._buffer or self._failed, timeout)
+
+            if not self._buffer:
+                return None
+
+            if self._policy is Policy.LATEST:
+                frame = self._buffer[-1]
+                self._dropped += len(self._buffer) - 1
+                self._buffer.clear()
+            else:
+                frame = self._buffer.popleft()
+            self._condition.notify_all()
+            return frame
+
+    def failed(self) -> bool:
+        """ True if the reading stopped because of a failed read """
+        return self._failed
+
+    def dropped(self) -> int:
+        """ number of frames which were skipped for a fresher one """
+        return self._dropped
+
+    def stop(self, timeout: float = 2):
+        """ stops the thread, read() is not called afterwards """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
@@ -1,60 +1,19 @@
 from __future__ import annotations
 
-import traceback
-import sys
+import threading
 
 import numpy as np
-from PyQt5 import QtCore
 
-from . import epa
+from . import analysis
 from . import data_classes
+from . import epa
 
 
-class WorkerSignals(QtCore.QObject):
-    finished = QtCore.pyqtSignal()
-    error = QtCore.pyqtSignal(tuple)
-    result = QtCore.pyqtSignal(tuple)
-
-
-class PLIAnalyser(QtCore.QRunnable):
-
-    def __init__(self, images):
-        super(PLIAnalyser, self).__init__()
-        self.images = images
-        self.signals = WorkerSignals()
-
-    @QtCore.pyqtSlot()
-    def run(self):
-        try:
-            print('thread: running analysis ...')
-            self._run_epa()
-            self._run_calc_incl()
-            self._run_tilting_simulation()
-            print('thread: analysis finished')
-        except:
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit((exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit((self.modalities, self.incl, self.tilts))
-        finally:
-            self.signals.finished.emit()  # Done
-
-    def _run_epa(self):
-        t, d, r = epa.epa(self.images.images)
-        self.modalities = data_classes.Modalities(t, d, r)
-
-    def _run_calc_incl(self):
-        inclination, wm_mask = epa.simple_incl(self.modalities.transmittance,
-                                               self.modalities.retardation)
-        self.incl = data_classes.Incl(inclination, wm_mask)
-
-    def _run_tilting_simulation(self):
-        self.tilts = epa.calc_tilts(self.modalities.transmittance,
-                                    self.modalities.direction,
-                                    self.modalities.retardation,
-                                    self.incl.inclination,
-                                    self.images.shape[-1])
+def _read_only(array):
+    """ view of array which can not be written """
+    view = array.view()
+    view.flags.writeable = False
+    return view
 
 
 class PLI():
@@ -68,36 +27,91 @@ class PLI():
     def __freeze(self):
         self.__is_frozen = True
 
-    def __init__(self, threshold):
+    def __init__(self,
+                 threshold,
+                 least_squares=False,
+                 num_threads=None,
+                 num_rot=18,
+                 scratch_dir=None,
+                 oversample=0,
+                 process_backend=False):
+        """
+        threshold: maximal distance of an angle to its rotation bin
+        least_squares: fit images with their measured angle instead,
+                       every angle is inserted into its nearest bin
+        num_threads: number of analysis threads, all cores if None
+        num_rot: number of equidistant rotations between [0,180) degree
+        scratch_dir: image stacks are memory mapped in this directory
+        oversample: minimal number of frames averaged per rotation bin,
+                    every later frame of a bin is averaged too, 0 disables
+        process_backend: analysis runs in a worker process instead of a thread
+        """
+        self._generation = 0
+        self._cancel = threading.Event()
+        # measurement settings, a restored session overrides them until reset
+        self._settings = {
+            'num_rot': num_rot,
+            'least_squares': least_squares,
+            'oversample': oversample
+        }
         self.reset()
         self._angle_threshold = threshold
-        self._num_rot = 18
+        self._num_threads = num_threads
+        self._scratch_dir = scratch_dir
+        self._process_backend = process_backend
 
         self.__freeze()
 
     def reset(self):
+        # a running analysis is stopped and its results are dropped
+        self._cancel.set()
+        self._generation += 1
+
         # TODO:rfc names???
         self._images = None
+        self._coefficients = None
+        self._gram = None
+        self._mean = None
+        self._m2 = None
+        self._counts = None
+        self._preview = None
         self._modalities = None
         self._inclination = None
         self._tilting = None
+        self._tilting_images = {}
+        self._directions = {}
         self._fom = None
+        self._final = False
         self._offset = 0
+        self._num_rot = self._settings['num_rot']
+        self._least_squares = self._settings['least_squares']
+        self._oversample = self._settings['oversample']
 
     def images(self, tilt):
         if tilt == 'center':
-            return self._images.images.copy()
+            return _read_only(self._images.images)
         elif tilt == 'north':
-            return self._tilting[0][0].copy()
+            return _read_only(self._tilt_images(0))
         elif tilt == 'east':
-            return self._tilting[0][1].copy()
+            return _read_only(self._tilt_images(1))
         elif tilt == 'south':
-            return self._tilting[0][2].copy()
+            return _read_only(self._tilt_images(2))
         elif tilt == 'west':
-            return self._tilting[0][3].copy()
+            return _read_only(self._tilt_images(3))
         else:
             raise ValueError(f'wrong tilt: {tilt}')
 
+    def _tilt_images(self, index):
+        # simulated images are only build on request, one tilt at a time
+        if index not in self._tilting_images:
+            self._tilting_images.clear()
+            shape = (self._num_rot,) + self._tilting[0][index].shape
+            self._tilting_images[index] = epa.tilt_images(
+                self._tilting[0][index], self._tilting[1][index],
+                self._tilting[2][index], self._num_rot,
+                data_classes.zeros(shape, np.uint8, self._scratch_dir))
+        return self._tilting_images[index]
+
     def rotations(self):
         rotations = self._images.rotations.copy() + self._offset
         rotations %= np.pi
@@ -108,12 +122,32 @@ class PLI():
     def valid(self):
         if self._images is None:
             return None
-        return self._images.valid[:]
+        return _read_only(self._images.valid)
+
+    def analysis_done(self):
+        """ True once the full resolution result is available """
+        return self._final
 
     def measurment_done(self):
         if self._images is None:
             return False
-        return np.all(self._images.valid)
+        if self._counts is not None:
+            complete = self._counts >= self._oversample
+        else:
+            complete = self._images.valid
+        if self._least_squares:
+            # the fit needs well spread angles instead of every bin, half of
+            # the bins keep the noise close to the one of a full sequence
+            return (np.sum(complete) >= max(3, (self._num_rot + 1) // 2) and
+                    epa.well_conditioned(self._gram))
+        return np.all(complete)
+
+    def variance(self):
+        """ per pixel variance of the averaged frames of each rotation bin """
+        if self._m2 is None:
+            return None
+        counts = np.maximum(self._counts - 1, 1)
+        return np.moveaxis(self._m2 / counts[:, None, None], 0, -1)
 
     def transmittance(self, tilt='center'):
         if self._modalities is None:
@@ -121,15 +155,15 @@ class PLI():
             return None
 
         if tilt == 'center':
-            return self._modalities.transmittance.copy()
+            return _read_only(self._modalities.transmittance)
         elif tilt == 'north':
-            return self._tilting[1][0].copy()
+            return _read_only(self._tilting[0][0])
         elif tilt == 'east':
-            return self._tilting[1][1].copy()
+            return _read_only(self._tilting[0][1])
         elif tilt == 'south':
-            return self._tilting[1][2].copy()
+            return _read_only(self._tilting[0][2])
         elif tilt == 'west':
-            return self._tilting[1][3].copy()
+            return _read_only(self._tilting[0][3])
         else:
             raise ValueError(f'wrong tilt: {tilt}')
 
@@ -138,24 +172,28 @@ class PLI():
             print('modalities could not be calculated yet')
             return None
 
-        if tilt == 'center':
-            direction = self._modalities.direction.copy()
-        elif tilt == 'north':
-            direction = self._tilting[2][0].copy()
-        elif tilt == 'east':
-            direction = self._tilting[2][1].copy()
-        elif tilt == 'south':
-            direction = self._tilting[2][2].copy()
-        elif tilt == 'west':
-            direction = self._tilting[2][3].copy()
-        else:
-            raise ValueError(f'wrong tilt: {tilt}')
-
-        direction[:] += self._offset
-        direction[:] %= np.pi
-        direction[:] += np.pi
-        direction[:] %= np.pi
-        return direction
+        # offset is applied once, cache is invalidated by apply_offset
+        if tilt not in self._directions:
+            if tilt == 'center':
+                direction = self._modalities.direction.copy()
+            elif tilt == 'north':
+                direction = self._tilting[1][0].copy()
+            elif tilt == 'east':
+                direction = self._tilting[1][1].copy()
+            elif tilt == 'south':
+                direction = self._tilting[1][2].copy()
+            elif tilt == 'west':
+                direction = self._tilting[1][3].copy()
+            else:
+                raise ValueError(f'wrong tilt: {tilt}')
+
+            direction[:] += self._offset
+            direction[:] %= np.pi
+            direction[:] += np.pi
+            direction[:] %= np.pi
+            self._directions[tilt] = direction
+
+        return _read_only(self._directions[tilt])
 
     def retardation(self, tilt='center'):
         if self._modalities is None:
@@ -163,15 +201,15 @@ class PLI():
             return None
 
         if tilt == 'center':
-            return self._modalities.retardation.copy()
+            return _read_only(self._modalities.retardation)
         elif tilt == 'north':
-            return self._tilting[3][0].copy()
+            return _read_only(self._tilting[2][0])
         elif tilt == 'east':
-            return self._tilting[3][1].copy()
+            return _read_only(self._tilting[2][1])
         elif tilt == 'south':
-            return self._tilting[3][2].copy()
+            return _read_only(self._tilting[2][2])
         elif tilt == 'west':
-            return self._tilting[3][3].copy()
+            return _read_only(self._tilting[2][3])
         else:
             raise ValueError(f'wrong tilt: {tilt}')
 
@@ -181,15 +219,15 @@ class PLI():
             return None
 
         if tilt == 'center':
-            return self._inclination.inclination.copy()
+            return _read_only(self._inclination.inclination)
         elif tilt == 'north':
-            return self._tilting[4][0].copy()
+            return _read_only(self._tilting[3][0])
         elif tilt == 'east':
-            return self._tilting[4][1].copy()
+            return _read_only(self._tilting[3][1])
         elif tilt == 'south':
-            return self._tilting[4][2].copy()
+            return _read_only(self._tilting[3][2])
         elif tilt == 'west':
-            return self._tilting[4][3].copy()
+            return _read_only(self._tilting[3][3])
         else:
             raise ValueError(f'wrong tilt: {tilt}')
 
@@ -197,50 +235,273 @@ class PLI():
         if self._inclination is None:
             print('wm mask could not be calculated yet')
             return None
-        return self._inclination.wm_mask.copy()
+        return _read_only(self._inclination.wm_mask)
 
     def fom(self):
         if self._fom is None:
             if self._inclination is None:
                 print('fom could not be calculated yet')
                 return None
-            self._fom = epa.fom(self.direction(), self.inclination())
-        return self._fom.copy()
+            self._fom = epa.fom(self.direction(),
+                                self.inclination(),
+                                lut=True)
+        return _read_only(self._fom)
+
+    def _solved_coefficients(self):
+        if self._gram is None:
+            return self._coefficients
+        return epa.solve_normal_equations(self._coefficients, self._gram)
+
+    def preview(self):
+        """ modalities of the running measurement, partially filled """
+        if self._coefficients is None:
+            return None
+
+        if self._preview is None:
+            if self._gram is None:
+                # scale to the full sequence for a comparable transmittance
+                num_valid = np.sum(self._images.valid)
+                if num_valid == 0:
+                    return None
+                coefficients = self._coefficients * (self._num_rot /
+                                                     num_valid)
+            elif epa.well_conditioned(self._gram):
+                coefficients = self._solved_coefficients()
+            else:
+                return None
+            self._preview = epa.epa_from_coefficients(coefficients)
+        return self._preview
 
     def insert(self, image: np.ndarray, angle: float):
+        if self._images is not None and tuple(
+                image.shape) != tuple(self._images.shape[:-1]):
+            # e.g. a restored session continued with another camera
+            print(f'Warning: frame {image.shape} does not match the ' +
+                  f'measurement {self._images.shape[:-1]}')
+            return
+
         if self._images is None:
             self._images = data_classes.Images(
-                list(image.shape) + [self._num_rot])
-
-        condition = np.abs(self._images.rotations -
-                           angle) < self._angle_threshold
-        if np.any(condition):
+                tuple(image.shape) + (self._num_rot,), image.dtype,
+                self._scratch_dir)
+            self._coefficients = np.zeros(list(image.shape) + [3],
+                                          np.float32)
+            if self._least_squares:
+                self._gram = np.zeros((3, 3))
+            if self._oversample:
+                # constant memory, independent of the number of frames
+                shape = (self._num_rot,) + tuple(image.shape)
+                self._mean = data_classes.zeros(shape, np.float32,
+                                                self._scratch_dir)
+                self._m2 = data_classes.zeros(shape, np.float32,
+                                              self._scratch_dir)
+                self._counts = np.zeros(self._num_rot, np.int64)
+
+        if self._least_squares:
+            # images are fitted with their measured angle, no threshold needed
+            index = int(np.round(angle / np.pi * self._num_rot)) % self._num_rot
+        else:
+            condition = np.abs(self._images.rotations -
+                               angle) < self._angle_threshold
+            if not np.any(condition):
+                return
             angle_ = self._images.rotations[np.argmax(condition)]
             index = int(np.argwhere(self._images.rotations == angle_))
-            if not self._images.valid[index]:
-                self._images.insert(image, index)
-                print(f'inserted {np.rad2deg(angle):.1f} -> ' +
-                      f'{np.rad2deg(angle_):.0f}: ' +
-                      f'{np.sum(self._images.valid)}/{self._images.shape[-1]}')
+
+        if self._oversample:
+            self._insert_mean(image, index, angle)
+            return
+
+        if self._images.valid[index]:
+            return
+
+        if self._least_squares:
+            self._images.insert(image, index, angle)
+            epa.accumulate_normal_equations(self._coefficients, self._gram,
+                                            image, angle)
+        else:
+            self._images.insert(image, index)
+            epa.accumulate_coefficients(self._coefficients, image, index,
+                                        self._num_rot)
+        self._preview = None
+        print(f'inserted {np.rad2deg(angle):.1f} -> ' +
+              f'{np.rad2deg(self._images.rotations[index]):.0f}: ' +
+              f'{np.sum(self._images.valid)}/{self._images.shape[-1]}')
+
+    def _insert_mean(self, image: np.ndarray, index: int, angle: float):
+        """ averages every frame of a rotation bin into its running mean """
+        self._counts[index] += 1
+        count = self._counts[index]
+        change = epa.accumulate_moments(self._mean[index], self._m2[index],
+                                        image, count)
+
+        if self._least_squares:
+            # each frame is fitted with its own angle, the bin keeps the mean
+            epa.accumulate_normal_equations(self._coefficients, self._gram,
+                                            image, angle)
+            mean_angle = angle
+            if count > 1:
+                mean_angle = self._images.angles[index]
+                delta = (angle - mean_angle + np.pi / 2) % np.pi - np.pi / 2
+                mean_angle += delta / count
+        else:
+            # coefficients are linear in the images, only the change is added
+            epa.accumulate_coefficients(self._coefficients, change, index,
+                                        self._num_rot)
+            mean_angle = None
+
+        self._images.update(np.rint(self._mean[index]), index, mean_angle)
+        self._preview = None
+        if count == 1:
+            print(f'inserted {np.rad2deg(angle):.1f} -> ' +
+                  f'{np.rad2deg(self._images.rotations[index]):.0f}: ' +
+                  f'{np.sum(self._images.valid)}/{self._images.shape[-1]}')
 
     def apply_offset(self, offset: float):
         self._offset = offset
+        self._directions = {}
         if self._fom is not None:
-            self._fom[:] = epa.fom(self.direction(), self.inclination())
+            self._fom[:] = epa.fom(self.direction(),
+                                   self.inclination(),
+                                   lut=True)
 
     def offset(self):
         return self._offset
 
-    def run_analysis(self, fun):
+    def state(self) -> dict:
+        """ arrays and values of the measurement and its results """
+        state = {
+            'num_rot': self._num_rot,
+            'least_squares': self._least_squares,
+            'oversample': self._oversample,
+            'offset': float(self._offset)
+        }
+
+        if self._images is not None:
+            state.update(frames=self._images.frames,
+                         angles=self._images.angles,
+                         valid=self._images.valid,
+                         coefficients=self._coefficients)
+            if self._gram is not None:
+                state.update(gram=self._gram)
+            if self._counts is not None:
+                state.update(mean=self._mean, m2=self._m2, counts=self._counts)
+
+        if self._modalities is not None:
+            state.update(
+                transmittance=self._modalities.transmittance,
+                direction=self._modalities.direction,
+                retardation=self._modalities.retardation,
+                inclination=self._inclination.inclination,
+                wm_mask=self._inclination.wm_mask,
+                tilt_direction=self._tilting[1],
+                tilt_retardation=self._tilting[2],
+                tilt_inclination=self._tilting[3],
+            )
+        return state
+
+    def restore(self, state: dict) -> None:
+        """ counterpart of state, arrays are used without copies """
+        self.reset()
+        # settings of the session, the next reset returns to the own ones
+        self._num_rot = state['num_rot']
+        self._least_squares = state.get('least_squares', 'gram' in state)
+        self._oversample = state.get('oversample', 0)
+        self._offset = state['offset']
+
+        if 'frames' in state:
+            frames = state['frames']
+            self._images = data_classes.Images(
+                frames.shape[1:] + frames.shape[:1], frames.dtype,
+                self._scratch_dir, frames, state['angles'], state['valid'])
+            # without coefficients the stack is analysed with epa_parallel
+            self._coefficients = state.get('coefficients')
+            self._gram = state.get('gram')
+            if self._oversample:
+                self._mean = state.get('mean')
+                self._m2 = state.get('m2')
+                self._counts = state.get('counts')
+
+        if 'transmittance' in state:
+            self._modalities = data_classes.Modalities(
+                state['transmittance'], state['direction'],
+                state['retardation'])
+            self._inclination = data_classes.Incl(state['inclination'],
+                                                  state['wm_mask'])
+            transmittance = state['transmittance']
+            self._tilting = (np.broadcast_to(transmittance,
+                                             (4,) + transmittance.shape),
+                             state['tilt_direction'],
+                             state['tilt_retardation'],
+                             state['tilt_inclination'])
+            self._final = True
+
+    def _save_result(self, result, final=True):
+        self._final = final
+        self._modalities = result[0]
+        self._inclination = result[1]
+        self._tilting = result[2]
+        self._tilting_images = {}
+        self._directions = {}
+        self._fom = None
+
+    def analyse(self, mask=None):
+        """ blocking analysis of the measurement, e.g. without a gui """
+        self._save_result(
+            analysis.analyse(self._images, self._solved_coefficients(),
+                             self._num_threads, mask))
+
+    def _snapshot(self):
+        """ stack and coefficients of an analysis, not changed by the gui """
+        coefficients = self._solved_coefficients()
+        if coefficients is None:
+            return self._images.snapshot(), None
+        if coefficients is self._coefficients:
+            coefficients = coefficients.copy()
+        coefficients.flags.writeable = False
+        # the analysis of coefficients does not read the frames
+        return self._images.layout(), coefficients
+
+    def run_analysis(self, fun, mask=None):
+        # qt is only needed for the analysis in the background
+        from PyQt5 import QtCore
+
+        from . import analyser
+
+        # only the latest analysis of the current measurement is kept
+        self._cancel.set()
+        self._cancel = threading.Event()
+        self._generation += 1
+        self._final = False
+        generation = self._generation
+
+        if self._process_backend:
+            runnable_class = analyser.ProcessAnalyser
+        else:
+            runnable_class = analyser.PLIAnalyser
+
         pool = QtCore.QThreadPool.globalInstance()
-        runnable = PLIAnalyser(self._images)
+        runnable = runnable_class(*self._snapshot(),
+                                  self._num_threads,
+                                  mask,
+                                  cancel=self._cancel)
+
+        def save_coarse(result):
+            if generation == self._generation:
+                self._save_result(result, final=False)
 
         def save(result):
-            self._modalities = result[0]
-            self._inclination = result[1]
-            self._tilting = result[2]
+            if generation == self._generation:
+                self._save_result(result)
+
+        def done(*_):
+            if generation == self._generation:
+                fun()
 
+        # coarse result is available first and replaced by the final one
+        runnable.signals.progress.connect(save_coarse)
+        runnable.signals.progress.connect(done)
         runnable.signals.result.connect(save)
-        runnable.signals.finished.connect(fun)
+        runnable.signals.finished.connect(done)
 
         pool.start(runnable)
@@ -0,0 +1,89 @@
+"""
+Single file sessions of complete measurements
+
+layout: magic, uint64 header size, json header, 64 byte aligned raw arrays.
+Arrays are memory mapped copy on write while loading, therefore opening a
+session does not read the stack.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'PLISESS1'
+ALIGNMENT = 64
+_SIZE = struct.Struct('<Q')
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save(file_name: str, state: dict) -> None:
+    """
+    state: {group: {name: value}}, values are ndarrays or json serializable
+    """
+    meta: dict[str, dict] = {}
+    arrays = {}
+    blobs = []
+    offset = 0
+    for group, values in state.items():
+        meta[group] = {}
+        for name, value in values.items():
+            if value is None:
+                continue
+            if not isinstance(value, np.ndarray):
+                meta[group][name] = value
+                continue
+            value = np.ascontiguousarray(value)
+            arrays[f'{group}/{name}'] = {
+                'dtype': value.dtype.str,
+                'shape': list(value.shape),
+                'offset': offset,
+            }
+            blobs.append((offset, value))
+            offset = _align(offset + value.nbytes)
+
+    header = json.dumps({
+        'version': 1,
+        'meta': meta,
+        'arrays': arrays
+    }).encode('utf-8')
+    data_start = _align(len(MAGIC) + _SIZE.size + len(header))
+
+    with open(file_name, 'wb') as file:
+        file.write(MAGIC)
+        file.write(_SIZE.pack(len(header)))
+        file.write(header)
+        for offset, value in blobs:
+            file.seek(data_start + offset)
+            value.tofile(file)
+
+
+def load(file_name: str) -> dict:
+    """ counterpart of save, arrays are lazy memory maps """
+    with open(file_name, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{file_name} is not a pli session')
+        size, = _SIZE.unpack(file.read(_SIZE.size))
+        header = json.loads(file.read(size).decode('utf-8'))
+    data_start = _align(len(MAGIC) + _SIZE.size + size)
+
+    state = {group: dict(values) for group, values in header['meta'].items()}
+    for key, info in header['arrays'].items():
+        group, name = key.split('/')
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        if np.prod(shape) == 0:
+            value = np.empty(shape, dtype)
+        else:
+            value = np.memmap(file_name,
+                              dtype,
+                              'c',
+                              offset=data_start + info['offset'],
+                              shape=shape)
+        state.setdefault(group, {})[name] = value
+    return state
@@ -0,0 +1,205 @@
+"""
+Analysis chain in a worker process, arrays are exchanged via shared memory
+
+Only names, shapes and dtypes of the shared memory blocks are pickled. The
+worker process is kept alive, so the numba kernels are compiled only once.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import multiprocessing
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import analysis
+from . import data_classes
+
+_POLL_INTERVAL = 0.05  # seconds between checks for a cancellation
+
+# name, leading dimensions and dtype of the (x,y)-results of the worker
+_RESULTS = (
+    ('transmittance', (), np.float32),
+    ('direction', (), np.float32),
+    ('retardation', (), np.float32),
+    ('inclination', (), np.float32),
+    ('wm_mask', (), np.bool_),
+    ('tilt_direction', (4,), np.float64),
+    ('tilt_retardation', (4,), np.float64),
+    ('tilt_inclination', (4,), np.float64),
+)
+
+_executor = None
+
+
+def _pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn instead of fork, the gui process runs several threads
+        _executor = concurrent.futures.ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _attach(spec: tuple) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name)
+    return shm, np.ndarray(shape, dtype, shm.buf)
+
+
+class _Flag:
+    """ threading.Event like view of a shared byte """
+
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    def is_set(self) -> bool:
+        return bool(self._array[0])
+
+
+def _analyse_shared(arrays: dict, shape: tuple, dtype: str,
+                    num_threads: int | None, factor: int) -> None:
+    frames = arrays['frames']
+    if frames is None:
+        # coefficients are analysed, the frames are not needed
+        frames = data_classes.no_frames(shape, dtype)
+    images = data_classes.Images(shape, np.dtype(dtype), None, frames,
+                                 arrays['angles'], arrays['valid'])
+    modalities, incl, tilts = analysis.analyse(images, arrays['coefficients'],
+                                               num_threads, arrays['mask'],
+                                               factor,
+                                               _Flag(arrays['cancel']))
+
+    values = (modalities.transmittance, modalities.direction,
+              modalities.retardation, incl.inclination, incl.wm_mask) + tuple(
+                  tilts[1:])
+    for (name, _, _), value in zip(_RESULTS, values):
+        arrays[name][...] = value
+
+
+def _run(specs: dict, shape: tuple, dtype: str, num_threads: int | None,
+         factor: int) -> None:
+    """ worker process, results are written into the shared memory """
+    blocks = {}
+    arrays: dict[str, np.ndarray | None] = {}
+    for key, spec in specs.items():
+        if spec is None:
+            arrays[key] = None
+        else:
+            blocks[key], arrays[key] = _attach(spec)
+
+    error: Exception | None = None
+    try:
+        _analyse_shared(arrays, shape, dtype, num_threads, factor)
+    except analysis.Cancelled:
+        error = analysis.Cancelled()
+    except Exception:
+        # the traceback would keep views of the shared memory alive
+        error = RuntimeError(traceback.format_exc())
+
+    arrays.clear()
+    for shm in blocks.values():
+        shm.close()
+
+    if error is not None:
+        raise error
+
+
+class Job:
+    """
+    shared memory of one analysis, e.g. for a coarse and a full pass
+
+    The inputs are copied once, the frames only if no coefficients are given.
+    Use as context manager, the shared memory is released on exit.
+    """
+
+    def __init__(self,
+                 images: data_classes.Images,
+                 coefficients: np.ndarray | None = None,
+                 mask: np.ndarray | None = None):
+        self._shape = tuple(images.shape)
+        self._dtype = np.dtype(images.dtype).str
+        self._blocks: dict[str, shared_memory.SharedMemory] = {}
+        self._arrays: dict[str, np.ndarray] = {}
+        self._specs: dict[str, tuple | None] = {}
+
+        try:
+            frames = images.frames if coefficients is None else None
+            for key, value in (('frames', frames), ('angles', images.angles),
+                               ('valid', images.valid),
+                               ('coefficients', coefficients), ('mask',
+                                                                mask)):
+                if value is None:
+                    self._specs[key] = None
+                else:
+                    self._share(key, value.shape, value.dtype)[...] = value
+            self._share('cancel', (1,), np.uint8)
+            for key, leading, dtype in _RESULTS:
+                self._share(key, leading + self._shape[:2], dtype)
+        except BaseException:
+            self.close()
+            raise
+
+    def _share(self, key: str, shape: tuple, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        self._blocks[key] = shared_memory.SharedMemory(create=True, size=size)
+        self._arrays[key] = np.ndarray(shape, dtype, self._blocks[key].buf)
+        self._specs[key] = (self._blocks[key].name, tuple(shape), dtype.str)
+        return self._arrays[key]
+
+    def __enter__(self) -> Job:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._arrays.clear()
+        for shm in self._blocks.values():
+            shm.close()
+            shm.unlink()
+        self._blocks.clear()
+
+    def analyse(self,
+                factor: int = 1,
+                num_threads: int | None = None,
+                cancel: threading.Event | None = None) -> tuple:
+        """
+        same as analysis.analyse, computed in the worker process
+
+        the calling thread only waits and does not hold the interpreter lock
+        """
+        self._arrays['cancel'][0] = 0
+        future = _pool().submit(_run, self._specs, self._shape, self._dtype,
+                                num_threads, factor)
+        while True:
+            try:
+                future.result(_POLL_INTERVAL)
+                break
+            except concurrent.futures.TimeoutError:
+                if cancel is not None and cancel.is_set():
+                    self._arrays['cancel'][0] = 1
+
+        values = {key: np.array(self._arrays[key]) for key, _, _ in _RESULTS}
+        transmittance = values['transmittance']
+        return (data_classes.Modalities(transmittance, values['direction'],
+                                        values['retardation']),
+                data_classes.Incl(values['inclination'], values['wm_mask']),
+                (np.broadcast_to(transmittance, (4,) + transmittance.shape),
+                 values['tilt_direction'], values['tilt_retardation'],
+                 values['tilt_inclination']))
+
+
+def analyse(images: data_classes.Images,
+            coefficients: np.ndarray | None = None,
+            num_threads: int | None = None,
+            mask: np.ndarray | None = None,
+            factor: int = 1,
+            cancel: threading.Event | None = None) -> tuple:
+    """ same as analysis.analyse, computed in a worker process """
+    with Job(images, coefficients, mask) as job:
+        return job.analyse(factor, num_threads, cancel)
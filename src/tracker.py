@@ -4,7 +4,66 @@ import typing
 
 import cv2
 import numpy as np
-import scipy.stats
+
+# refinement of downscaled detections at full resolution
+_SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10,
+                    0.1)
+
+# rotation model of the predictive tracking
+_MEASUREMENT_NOISE = np.deg2rad(0.2)  # std of a detected rotation
+_ACCELERATION_NOISE = np.deg2rad(0.1)  # std of the velocity change per frame
+_GATE = 5  # maximal deviation from the prediction in std
+_MIN_GATE = np.deg2rad(1)
+_MIN_STICKERS = 3  # in the search windows, otherwise full detection
+_WINDOW_STICKERS = 4  # windows are searched until found
+
+
+class RotationModel:
+    """ constant angular velocity kalman filter of the unwrapped rotation """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._state = None  # angle, angular velocity per frame
+        self._covariance = None
+
+    def predict(self) -> typing.Optional[float]:
+        """ advances the model by one frame """
+        if self._state is None:
+            return None
+        transition = np.array([[1.0, 1.0], [0.0, 1.0]])
+        noise = _ACCELERATION_NOISE**2 * np.array([[0.25, 0.5], [0.5, 1.0]])
+        self._state = transition @ self._state
+        self._covariance = transition @ self._covariance @ transition.T + noise
+        return self._state[0]
+
+    def _innovation(self, angle: float) -> float:
+        return (angle - self._state[0] + np.pi) % (2 * np.pi) - np.pi
+
+    def consistent(self, angle: float) -> bool:
+        """ checks a measured angle against the prediction """
+        if self._state is None:
+            return True
+        std = np.sqrt(self._covariance[0, 0] + _MEASUREMENT_NOISE**2)
+        return abs(self._innovation(angle)) <= max(_GATE * std, _MIN_GATE)
+
+    def update(self, angle: float) -> float:
+        """ corrects the model with a measured angle, filtered angle """
+        if self._state is None:
+            self._state = np.array([angle, 0.0])
+            self._covariance = np.diag(
+                [_MEASUREMENT_NOISE**2,
+                 np.deg2rad(5)**2])
+            return angle
+
+        innovation = self._innovation(angle)
+        gain = self._covariance[:, 0] / (self._covariance[0, 0] +
+                                         _MEASUREMENT_NOISE**2)
+        self._state = self._state + gain * innovation
+        self._covariance = self._covariance - np.outer(gain,
+                                                       self._covariance[0])
+        return self._state[0]
 
 
 class Tracker:
@@ -18,14 +77,31 @@ class Tracker:
     def __freeze(self):
         self.__is_frozen = True
 
-    def __init__(self, num_sticker: int, sticker_zero_id: int):
+    def __init__(self,
+                 num_sticker: int,
+                 sticker_zero_id: int,
+                 detection_scale: float = 1.0,
+                 full_detection_every: int = 0):
         """ 
         num_sticker: number of stickers on pli
         sticker_zero_id: cv sticker id of sticker which should indicate rot=0
+        detection_scale: after calibration stickers are detected in a
+                         downscaled image and refined at full resolution,
+                         fastest for 1/2, 1/3, ..., 1 disables
+        full_detection_every: stickers are searched only around their
+                              predicted positions and the whole annulus
+                              every n frames, 0 disables the prediction
         """
+        self._model = RotationModel()
         self.reset()
         self._num_sticker = num_sticker
         self._sticker_zero_id = sticker_zero_id
+        self._detection_scale = detection_scale
+        self._full_detection_every = full_detection_every
+
+        # detector is build once instead of each frame
+        self._dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
+        self._parameters = cv2.aruco.DetectorParameters_create()
         self.__freeze()
 
     def reset(self):
@@ -35,6 +111,19 @@ class Tracker:
         self._cur_ids = None
         self._radius = None
         self._mask = None
+        self._crop = None
+        self._ref_index = None
+        self._ref_vectors = None
+        self._buffers = {}
+        self._canvases = {}
+        self._roi = None
+        self._roi_keep = None
+        self._roi_parameters = None
+        self._window_parameters = None
+        self._window_size = None
+        self._window_order = None
+        self._since_detection = 0
+        self._model.reset()
         self._input_shape = None
         self._illumination_center = None
         self._illumination_radius = None
@@ -48,102 +137,247 @@ class Tracker:
     def get_mask(self):
         return self._mask
 
+    def input_shape(self):
+        return self._input_shape
+
+    def matches(self, image: np.ndarray) -> bool:
+        """ False for frames of another camera than the calibration """
+        return self._input_shape is None or tuple(
+            image.shape) == tuple(self._input_shape)
+
+    def state(self) -> dict:
+        """ calibration arrays and values """
+        if not self.calibrated():
+            return {}
+        return {
+            'cal_corners': self._cal_corners,
+            'cal_ids': self._cal_ids,
+            'input_shape': [int(elm) for elm in self._input_shape],
+            'illumination_center': self._illumination_center,
+            'illumination_radius': float(self._illumination_radius),
+            'sticker_zero_angle': float(self._sticker_zero_angle),
+        }
+
+    def restore(self, state: dict) -> None:
+        """ counterpart of state """
+        self.reset()
+        if not state:
+            return
+        self._cal_corners = np.array(state['cal_corners'])
+        self._cal_ids = np.array(state['cal_ids'])
+        self._input_shape = tuple(state['input_shape'])
+        self._illumination_center = np.array(state['illumination_center'])
+        self._illumination_radius = state['illumination_radius']
+        self._sticker_zero_angle = state['sticker_zero_angle']
+        self._geometry_init()
+        self._reference_init()
+
     def mask_img(self, image: np.ndarray) -> np.ndarray:
+        """ masked image in a reused buffer, valid until the next call """
         if not self.calibrated():
             raise ValueError('tracker not calibrated yet')
 
-        if self._mask is None:
-            x = np.arange(0, self._input_shape[0], dtype=np.float64)
-            y = np.arange(0, self._input_shape[1], dtype=np.float64)
-            X = np.repeat(x[:, None], self._input_shape[1], axis=1)
-            Y = np.repeat(y[None, :], self._input_shape[0], axis=0)
-            X -= self._illumination_center[1]
-            Y -= self._illumination_center[0]
-            self._mask = X**2 + Y**2 < self._illumination_radius**2
-            self._mask = self.crop_img(self._mask)
-
-            # experience values for Wupperthal section
-            dh = int(self._illumination_radius * 0.275)
-            self._mask[:dh, :] = 0
-            self._mask[-int(dh * 1.4):, :] = 0
+        key = (image.shape, image.dtype)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty_like(image)
 
-        if image.ndim == 2:
-            res = np.multiply(self._mask, image)
-        else:
-            res = np.multiply(self._mask[:, :, None], image)
-        return res
+        mask = self._mask if image.ndim == 2 else self._mask[:, :, None]
+        return np.multiply(image, mask, out=self._buffers[key])
 
-    def _crop_init(self):
-        if not self.calibrated():
-            raise ValueError('tracker not calibrated yet')
-        x = np.arange(0, self._input_shape[1], dtype=np.float64)
-        y = np.arange(0, self._input_shape[0], dtype=np.float64)
-        x -= self._illumination_center[0]
-        y -= self._illumination_center[1]
-        x = np.abs(x)
-        y = np.abs(y)
+    def _geometry_init(self):
+        """ crop and mask of the illuminated area, computed once """
+        center = self._illumination_center
+        radius = self._illumination_radius
 
-        return x, y
+        crop = []
+        for size, pos in zip(self._input_shape[:2], center[::-1]):
+            inside = np.flatnonzero(np.abs(np.arange(size) - pos) < radius)
+            crop.append(slice(int(inside[0]), int(inside[-1])))
+        self._crop = tuple(crop)
 
-    def crop_offset(self):
-        x, y = self._crop_init()
-        x_start = int(np.argmax(x < self._illumination_radius))
-        y_start = int(np.argmax(y < self._illumination_radius))
+        y, x = np.ogrid[self._crop[0], self._crop[1]]
+        self._mask = (y - center[1])**2 + (x - center[0])**2 < radius**2
+
+        # experience values for Wupperthal section
+        dh = int(radius * 0.275)
+        self._mask[:dh, :] = 0
+        self._mask[-int(dh * 1.4):, :] = 0
 
-        return y_start, x_start
+        self._buffers = {}
+        self._canvases = {}
+
+    def crop_offset(self):
+        if not self.calibrated():
+            raise ValueError('tracker not calibrated yet')
+        return self._crop[0].start, self._crop[1].start
 
     def crop_img(self, image: np.ndarray) -> np.ndarray:
-        x, y = self._crop_init()
-        x_start = int(np.argmax(x < self._illumination_radius))
-        x_end = x.size - int(np.argmax(x[::-1] < self._illumination_radius)) - 1
-        y_start = int(np.argmax(y < self._illumination_radius))
-        y_end = y.size - int(np.argmax(y[::-1] < self._illumination_radius)) - 1
-        return np.ascontiguousarray(image[y_start:y_end, x_start:x_end])
+        """ view of the illuminated area """
+        if not self.calibrated():
+            raise ValueError('tracker not calibrated yet')
+        return image[self._crop]
 
     def rev_crop_img(self, image: np.ndarray) -> np.ndarray:
-        x, y = self._crop_init()
-        x_start = int(np.argmax(x < self._illumination_radius))
-        x_end = x.size - int(np.argmax(x[::-1] < self._illumination_radius)) - 1
-        y_start = int(np.argmax(y < self._illumination_radius))
-        y_end = y.size - int(np.argmax(y[::-1] < self._illumination_radius)) - 1
+        """ image placed in a reused full frame, valid until the next call """
+        if not self.calibrated():
+            raise ValueError('tracker not calibrated yet')
 
         if image.ndim == 2:
-            re_shape = self._input_shape
+            re_shape = tuple(self._input_shape[:2])
         else:
             re_shape = (self._input_shape[0], self._input_shape[1], 3)
 
-        re_image = np.zeros(re_shape, dtype=image.dtype)
-        re_image[y_start:y_end, x_start:x_end, ...] = image
+        key = (re_shape, image.dtype)
+        if key not in self._canvases:
+            self._canvases[key] = np.zeros(re_shape, dtype=image.dtype)
+
+        re_image = self._canvases[key]
+        re_image[self._crop] = image
         return re_image
 
     def current_angle(self, image: np.ndarray) -> typing.Optional[float]:
-        cv_corners, cv_ids = self._process_image(image)
-
-        corners = np.array(cv_corners)
-        corners.shape = (-1, 4, 2)
-        ids = np.array(cv_ids).ravel()
+        if not self.matches(image):
+            return None
 
-        if ids[0] is None:
+        if self._full_detection_every > 0:
+            rotation = self._tracked_rotation(image)
+            if rotation is None:
+                return None
+            return (rotation - self._sticker_zero_angle) % np.pi
+
+        angle = self.current_angles([image])[0]
+        return None if np.isnan(angle) else angle
+
+    def current_angles(self, images: typing.Sequence[np.ndarray]) -> np.ndarray:
+        """ angles of a block of frames, nan if no sticker was found """
+        angles = np.full(len(images), np.nan)
+
+        if self._full_detection_every > 0:
+            # the prediction depends on the previous frame
+            for i, image in enumerate(images):
+                angle = self.current_angle(image)
+                if angle is not None:
+                    angles[i] = angle
+            return angles
+
+        corners, ids, frames = [], [], []
+        for i, image in enumerate(images):
+            if not self.matches(image):
+                continue
+            cv_corners, cv_ids = self._process_image(image)
+            if cv_ids is None or len(cv_corners) == 0:
+                continue
+            corners.append(np.reshape(cv_corners, (-1, 4, 2)))
+            ids.append(np.ravel(cv_ids))
+            frames.append(np.full(ids[-1].size, i))
+        if not ids:
+            return angles
+
+        phi, known = self._rotations(np.concatenate(corners),
+                                     np.concatenate(ids))
+        frames = np.concatenate(frames)[known]
+
+        # circular mean with a period of pi of each frame
+        phi = 2 * (phi - self._sticker_zero_angle)
+        count = np.bincount(frames, minlength=angles.size)
+        sin = np.bincount(frames, np.sin(phi), angles.size)
+        cos = np.bincount(frames, np.cos(phi), angles.size)
+        found = count > 0
+        angles[found] = np.arctan2(sin[found], cos[found]) / 2 % np.pi
+        return angles
+
+    def _tracked_rotation(self,
+                          image: np.ndarray) -> typing.Optional[float]:
+        """ filtered rotation since the calibration, unwrapped """
+        prediction = self._model.predict()
+
+        if (prediction is not None and
+                self._since_detection < self._full_detection_every):
+            phi = self._sticker_angles(*self._detect_windows(image, prediction))
+            if phi is not None and phi.size >= _MIN_STICKERS:
+                rotation = self._mean_rotation(phi)
+                if self._model.consistent(rotation):
+                    self._since_detection += 1
+                    return self._model.update(rotation)
+
+        # periodically or if the prediction is lost
+        self._since_detection = 0
+        phi = self._sticker_angles(*self._process_image(image))
+        if phi is None:
             return None
+        rotation = self._mean_rotation(phi)
+        if not self._model.consistent(rotation):
+            self._model.reset()
+        return self._model.update(rotation)
+
+    @staticmethod
+    def _mean_rotation(phi: np.ndarray) -> float:
+        return float(np.arctan2(np.mean(np.sin(phi)), np.mean(np.cos(phi))))
+
+    def _detect_windows(self, image: np.ndarray,
+                        rotation: float) -> tuple[typing.Any, typing.Any]:
+        """ detection in windows around the predicted sticker positions """
+        self._roi_init()
+        center = self._illumination_center
+        rot = np.array([[np.cos(rotation), np.sin(rotation)],
+                        [-np.sin(rotation), np.cos(rotation)]])
+        positions = self._ref_vectors[self._window_order] @ rot.T + center
+
+        cv_corners = []
+        cv_ids = []
+        size = self._window_size
+        for x, y in positions:
+            x_start, y_start = int(x) - size, int(y) - size
+            if (x_start < 0 or y_start < 0 or
+                    x_start + 2 * size > self._input_shape[1] or
+                    y_start + 2 * size > self._input_shape[0]):
+                continue
+            window = self._filter_image(image[y_start:y_start + 2 * size,
+                                              x_start:x_start + 2 * size])
+            corners, ids = self._detect(window, self._window_parameters)
+            offset = np.array([x_start, y_start], np.float32)
+            for elm, id_ in zip(corners, np.array(ids).ravel()):
+                if id_ is not None and id_ not in cv_ids:
+                    cv_corners.append(elm + offset)
+                    cv_ids.append(id_)
+            if len(cv_ids) >= _WINDOW_STICKERS:
+                break
 
-        phi = []
-        for j in range(ids.size):
-            center_sticker = np.mean(corners[j, :, :], axis=0)
-
-            # calc ref vector and current sticker vector
-            i = np.argwhere(np.array(self._cal_ids) == ids[j])
-            ref = np.mean(np.squeeze(self._cal_corners[i, :, :]),
-                          axis=0) - self._illumination_center
-            cur = center_sticker - self._illumination_center
-
-            # calc angle
-            z = cur[0] * ref[1] - cur[1] * ref[0]  # helper for 2d sign problem
-            value = np.dot(ref,
-                           cur) / (np.linalg.norm(ref) * np.linalg.norm(cur))
-            value = max(-1.0, min(1.0, value))
-            phi.append(np.arccos(value) * np.sign(z))
-        return scipy.stats.circmean(
-            np.array(phi) - self._sticker_zero_angle, np.pi, 0)
+        self._cur_corners = np.array(cv_corners)
+        self._cur_ids = np.array(cv_ids)
+        if not cv_ids:
+            return [], None
+        return cv_corners, np.array(cv_ids)[:, None]
+
+    def _sticker_angles(self, cv_corners: typing.Any,
+                        cv_ids: typing.Any) -> typing.Optional[np.ndarray]:
+        """ rotation of each detected sticker since the calibration """
+        if cv_ids is None or len(cv_corners) == 0:
+            return None
+        phi, _ = self._rotations(np.asarray(cv_corners), np.ravel(cv_ids))
+        return phi if phi.size > 0 else None
+
+    def _rotations(self, corners: np.ndarray,
+                   ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ rotation of all stickers at once, unknown ids are dropped """
+        known = ids < self._ref_index.size
+        known[known] = self._ref_index[ids[known]] >= 0
+
+        cur = corners.reshape(-1, 4, 2)[known].mean(axis=1)
+        cur -= self._illumination_center
+        ref = self._ref_vectors[self._ref_index[ids[known]]]
+
+        # signed angle from the calibrated to the current sticker position
+        cross = cur[:, 0] * ref[:, 1] - cur[:, 1] * ref[:, 0]
+        dot = np.sum(ref * cur, axis=1)
+        return np.arctan2(cross, dot), known
+
+    def _reference_init(self):
+        """ id -> calibrated sticker vector lookup """
+        self._ref_index = np.full(self._cal_ids.max() + 1, -1)
+        self._ref_index[self._cal_ids] = np.arange(self._cal_ids.size)
+        self._ref_vectors = (self._cal_corners.mean(axis=1) -
+                             self._illumination_center)
 
     def _filter_image(self, image: np.ndarray) -> np.ndarray:
         """ filter image to improve tracking """
@@ -151,14 +385,121 @@ class Tracker:
         image = (255 - image)  # inverted codes
         return image
 
-    def _process_image(self,
-                       image: np.ndarray) -> tuple[typing.Any, typing.Any]:
-        image = self._filter_image(image)
-        cv2.aruco_dict = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
-        parameters = cv2.aruco.DetectorParameters_create()
+    def _roi_init(self) -> tuple[slice, slice]:
+        """ bounding box of the sticker annulus, inner disk is masked out """
+        if self._roi is None:
+            center = self._illumination_center
+            corners = self._cal_corners.reshape(-1, 2)
+            radii = np.linalg.norm(corners - center, axis=1)
+
+            # stickers only rotate, their corners stay within the annulus
+            side = np.mean(
+                np.linalg.norm(self._cal_corners -
+                               np.roll(self._cal_corners, 1, axis=1),
+                               axis=-1))
+            inner = max(radii.min() - side / 2, 0)
+            outer = radii.max() + side / 2
+
+            x_start = max(int(center[0] - outer), 0)
+            x_end = min(int(np.ceil(center[0] + outer)) + 1,
+                        self._input_shape[1])
+            y_start = max(int(center[1] - outer), 0)
+            y_end = min(int(np.ceil(center[1] + outer)) + 1,
+                        self._input_shape[0])
+            self._roi = (slice(y_start, y_end), slice(x_start, x_end))
+
+            # stickers are detected at the downscaled resolution, same
+            # rounding as cv2.resize
+            scale = min(self._detection_scale, 1)
+            width = int(round((x_end - x_start) * scale))
+            height = int(round((y_end - y_start) * scale))
+            x = (np.arange(width) + 0.5) / scale - 0.5 + x_start
+            y = (np.arange(height) + 0.5) / scale - 0.5 + y_start
+            self._roi_keep = ((x[None, :] - center[0])**2 +
+                              (y[:, None] - center[1])**2 >= inner**2).astype(
+                                  np.uint8)
+
+            # sticker size is known, one threshold window and perimeter range
+            side *= scale
+            size = max(width, height)
+            window = max(int(side / 3) | 1, 3)
+            parameters = cv2.aruco.DetectorParameters_create()
+            parameters.adaptiveThreshWinSizeMin = window
+            parameters.adaptiveThreshWinSizeMax = window
+            parameters.minMarkerPerimeterRate = 0.5 * 4 * side / size
+            parameters.maxMarkerPerimeterRate = 2 * 4 * side / size
+            self._roi_parameters = parameters
+
+            # search windows around predicted stickers, full resolution
+            side /= scale
+            self._window_size = int(side)
+            parameters = cv2.aruco.DetectorParameters_create()
+            parameters.adaptiveThreshWinSizeMin = max(int(side / 3) | 1, 3)
+            parameters.adaptiveThreshWinSizeMax = max(int(side / 3) | 1, 3)
+            parameters.minMarkerPerimeterRate = 0.5 * 4 * side / (2 * side)
+            parameters.maxMarkerPerimeterRate = 4
+            self._window_parameters = parameters
+
+            # opposite stickers first, errors of the center cancel out
+            delta = self._ref_vectors
+            order = np.argsort(np.arctan2(delta[:, 1], delta[:, 0]))
+            half = order.size // 2
+            pairs = list(range(0, half, 2)) + list(range(1, half, 2))
+            self._window_order = np.concatenate(
+                [order[[i, i + half]] for i in pairs] + [order[2 * half:]])
+        return self._roi
+
+    def _detect(self,
+                image: np.ndarray,
+                parameters: typing.Any = None) -> tuple[typing.Any, typing.Any]:
+        if parameters is None:
+            parameters = self._parameters
         cv_corners, cv_ids, _ = cv2.aruco.detectMarkers(image,
-                                                        cv2.aruco_dict,
+                                                        self._dictionary,
                                                         parameters=parameters)
+        return cv_corners, cv_ids
+
+    def _detect_roi(self,
+                    image: np.ndarray) -> tuple[typing.Any, typing.Any]:
+        """ detection restricted to the sticker annulus of a calibration """
+        roi = self._roi_init()
+        image = image[roi]
+
+        scale = self._detection_scale
+        if scale < 1:
+            # area interpolation already smooths, filtering is done downscaled
+            # fx, fy instead of the size for the fast integer factor path
+            small = cv2.resize(image,
+                               None,
+                               fx=scale,
+                               fy=scale,
+                               interpolation=cv2.INTER_AREA)
+            small = self._filter_image(small)
+            np.multiply(small, self._roi_keep, out=small)
+            cv_corners, cv_ids = self._detect(small, self._roi_parameters)
+            if len(cv_corners) > 0:
+                corners = np.concatenate(cv_corners).reshape(-1, 1, 2)
+                corners = (corners + 0.5) / scale - 0.5
+                window = int(np.ceil(1 / scale)) + 1
+                corners = cv2.cornerSubPix(np.ascontiguousarray(image),
+                                           corners.astype(np.float32),
+                                           (window, window), (-1, -1),
+                                           _SUBPIX_CRITERIA)
+                cv_corners = list(corners.reshape(-1, 1, 4, 2))
+        else:
+            image = self._filter_image(image)
+            np.multiply(image, self._roi_keep, out=image)
+            cv_corners, cv_ids = self._detect(image, self._roi_parameters)
+
+        offset = np.array([roi[1].start, roi[0].start], np.float32)
+        return [elm + offset for elm in cv_corners], cv_ids
+
+    def _process_image(self,
+                       image: np.ndarray) -> tuple[typing.Any, typing.Any]:
+        if self.calibrated():
+            cv_corners, cv_ids = self._detect_roi(image)
+        else:
+            cv_corners, cv_ids = self._detect(self._filter_image(image))
 
         self._cur_corners = np.array(cv_corners)
         self._cur_ids = np.array(cv_ids)
@@ -168,11 +509,7 @@ class Tracker:
     def add_info_view(self, image):
         image = self._filter_image(image)
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-        cv2.aruco_dict = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
-        parameters = cv2.aruco.DetectorParameters_create()
-        cv_corners, cv_ids, _ = cv2.aruco.detectMarkers(image,
-                                                        cv2.aruco_dict,
-                                                        parameters=parameters)
+        cv_corners, cv_ids = self._detect(image)
         if len(cv_corners) > 0:
             image = cv2.aruco.drawDetectedMarkers(image, cv_corners, cv_ids)
             image = image
@@ -215,6 +552,8 @@ class Tracker:
 
         # calc radius of illuminated pli:
         self._illumination_radius = self._calc_illumination_circle_radius()
+        self._geometry_init()
+        self._reference_init()
 
         # calculate sticker_zero angle
         index_zero_sticker = np.argwhere(
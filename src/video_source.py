@@ -0,0 +1,111 @@
+"""
+Video file decoded ahead in a thread
+
+The source behaves like a cv2.VideoCapture of the file, but read() takes the
+next frame out of a queue and the video is looped without property queries.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import typing
+
+import cv2
+import numpy as np
+
+# properties which are read once when the file is opened
+_PROPERTIES = (cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FPS,
+               cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT)
+
+
+class VideoSource:
+    """
+    convert: applied to each decoded frame in the thread, e.g. the channel
+        selection of CapDev
+    size: number of frames decoded ahead
+    """
+
+    __is_frozen = False
+
+    def __setattr__(self, key, value):
+        if self.__is_frozen and not hasattr(self, key):
+            raise TypeError('%r is a frozen class' % self)
+        object.__setattr__(self, key, value)
+
+    def __freeze(self):
+        self.__is_frozen = True
+
+    def __init__(self,
+                 file_name: str,
+                 convert: typing.Callable[[np.ndarray], np.ndarray]
+                 | None = None,
+                 size: int = 16):
+        self._capture = cv2.VideoCapture(file_name)
+        self._opened = self._capture.isOpened()
+        self._properties = {
+            prop: self._capture.get(prop) if self._opened else 0
+            for prop in _PROPERTIES
+        }
+        self._convert = convert
+        self._queue: queue.Queue[tuple[bool, np.ndarray | None]] = \
+            queue.Queue(max(1, size))
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='video',
+                                        daemon=True)
+
+        # freeze class
+        self.__freeze()
+
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while self._running:
+                success, frame = self._capture.read()
+                if not success:
+                    # end of the file, a second failure means it is broken
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    success, frame = self._capture.read()
+                if not success:
+                    break
+                if self._convert is not None:
+                    frame = self._convert(frame)
+                self._put((True, frame))
+        finally:
+            self._put((False, None))
+            self._capture.release()
+
+    def _put(self, item):
+        # does not block a release() while the queue is full
+        while self._running:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        """ next frame, blocks until it is decoded """
+        while True:
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    return False, None
+
+    def get(self, prop: int) -> float:
+        """ property of the file, 0 for properties which are not cached """
+        return self._properties.get(prop, 0)
+
+    def set(self, prop: int, value: float) -> bool:
+        """ properties of a file can not be set """
+        return False
+
+    def isOpened(self) -> bool:
+        return self._opened and self._thread.is_alive()
+
+    def release(self):
+        self._running = False
+        self._thread.join(2)
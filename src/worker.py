@@ -8,10 +8,9 @@ import pathlib
 import cv2
 
 import numpy as np
-import PIL.Image
 from PyQt5 import QtCore, QtGui, QtWidgets
 
-from . import capture_device, pli, tracker
+from . import capture_device, export, grabber, pli, session, tracker
 
 # from functools import wraps
 # from time import time
@@ -83,6 +82,7 @@ class MainThread():
         self.input_mode = None
         self.state = self.State.TRACKING
         self._debug = False
+        self._preview = False
         self._denoise_method = self.Denoise.NONE
         self._tilt = self.Tilt.CENTER
         self._xy_buffer = []
@@ -96,18 +96,38 @@ class MainThread():
         self.parent.plotwidget.clear()
 
         # pli
-        self.pli = pli.PLI(np.deg2rad(self.parent.args.insert_threshold))
+        if hasattr(self, 'pli'):
+            # a running analysis of the previous measurement is dropped
+            self.pli.reset()
+        self.pli = pli.PLI(np.deg2rad(self.parent.args.insert_threshold),
+                           self.parent.args.least_squares,
+                           self.parent.args.threads,
+                           self.parent.args.num_rot,
+                           self.parent.args.scratch_dir,
+                           self.parent.args.oversample,
+                           self.parent.args.process_backend)
         self.parent.main_menu['pli'].set_enabled(False)
 
         # tracker
-        self.tracker = tracker.Tracker(num_sticker=10, sticker_zero_id=10)
+        self.tracker = tracker.Tracker(
+            num_sticker=10,
+            sticker_zero_id=10,
+            detection_scale=self.parent.args.detection_scale,
+            full_detection_every=self.parent.args.full_detection_every)
 
         # camera
         self.parent.main_menu['camera']['port'].clear()
+        if hasattr(self, 'device'):
+            # stops the grabber thread of the previous device
+            self.device.release_device()
         self.device = capture_device.CapDev(
             port=self.parent.args.port,
             properties=self.parent.args.resolution,
-            file_name=self.parent.args.video)
+            file_name=self.parent.args.video,
+            threaded=self.parent.args.threaded_capture,
+            buffer_size=self.parent.args.capture_buffer,
+            policy=grabber.Policy.ALL
+            if self.parent.args.keep_all_frames else grabber.Policy.LATEST)
 
         for port in self.device.ports():
             self.parent.main_menu['camera']['port'].add_action(
@@ -122,6 +142,9 @@ class MainThread():
     def switch_debug(self):
         self._debug = not self._debug
 
+    def switch_preview(self):
+        self._preview = not self._preview
+
     def to_live_mode(self):
         self.parent.worker.start(self.parent._mspf)
         if not self.tracker.calibrated():
@@ -137,15 +160,15 @@ class MainThread():
         self.tracker.reset()
         self.device.activate_camera(port)
 
-    def check_device_properties(self):
-        res = self.device.get_resolutions()
+    def check_device_properties(self, rescan=False):
+        res = self.device.get_resolutions(rescan)
         if res is None:
             print('No device set yet')
             return
 
         self.parent.main_menu['camera']['resolution'].clear()
         self.parent.main_menu['camera']['resolution'].add_action(
-            'scan', lambda: self.check_device_properties())
+            'scan', lambda: self.check_device_properties(rescan=True))
         for r in res:
             self.parent.main_menu['camera']['resolution'].add_action(
                 f'{r[0]}x{r[1]}, {r[2]} fps',
@@ -188,6 +211,11 @@ class MainThread():
             print('---> resetting ...')
             self.reset()
 
+        if frame is None:
+            # no new frame of the grabber thread, a frame is never tracked
+            # or inserted twice
+            return
+
         # denoise
         if self._denoise_method == self.Denoise.NONE:
             denoise = lambda x: x
@@ -203,7 +231,14 @@ class MainThread():
             raise ValueError("wrong input")
         frame = denoise(frame)
 
-        if self.state == self.State.LIVE:
+        if self.state != self.State.TRACKING and not self.tracker.matches(
+                frame):
+            # a loaded session is only tracked and continued with frames of
+            # its own camera
+            self._angle = None
+            self.parent.statusbar.showMessage(
+                'frame size differs from the loaded session', 1000)
+        elif self.state == self.State.LIVE:
             self.next_live(frame)
         elif self.state == self.State.TRACKING:
             self.next_tracking(frame)
@@ -225,20 +260,25 @@ class MainThread():
             frame = self.tracker.add_info_view(frame)
 
         if not self._debug:
-            if self.tracker.calibrated():
+            # frames of another camera than a loaded session are not cropped
+            if self.tracker.calibrated() and self.tracker.matches(frame):
                 frame = self.tracker.crop_img(frame)
                 frame = self.tracker.mask_img(frame)
+            if self._preview and self.state == self.State.MEASUREMENT:
+                frame = self.preview_image(frame)
         self.show_image(frame)
 
-        # update plot and gui if rotation is significant
+        # update plot and gui if rotation is significant, the angle is lost
+        # if the stickers are not visible
+        if self._angle is None:
+            return
         if self._last_angle is None:
             self._last_angle = self._angle
-        else:
-            if abs(diff_angles(self._last_angle, self._angle,
-                               np.pi)) > self._update_angle:
-                self._last_angle = self._angle
-                self.update_plot()
-                self.update_gui()
+        elif abs(diff_angles(self._last_angle, self._angle,
+                             np.pi)) > self._update_angle:
+            self._last_angle = self._angle
+            self.update_plot()
+            self.update_gui()
 
     def update_plot(self):
         if len(self._xy_buffer) > 0:
@@ -250,6 +290,10 @@ class MainThread():
                                                       self.pli.valid()])
             self.parent.plotwidget.update_data(x_data, y_data)
 
+        # e.g. a loaded session before any frame was tracked
+        if self._angle is None:
+            return
+
         val = self._angle + self.pli.offset()
         val %= np.pi
         val += np.pi
@@ -297,6 +341,11 @@ class MainThread():
         self.parent.main_menu['pli']['live'].set_enabled(False)
         self.parent.main_menu['pli']['tilts']['center'].set_enabled(False)
 
+        # refresh shown modality, e.g. after the coarse result got refined
+        if self._last_img_name != 'live':
+            self.parent.main_menu['pli'][self._last_img_name].set_enabled(True)
+            self.parent.main_menu['pli'][self._last_img_name].trigger()
+
     def next_measurement(self, frame: np.ndarray):
         if self.pli.measurment_done():
             raise ValueError('measurment already done')
@@ -311,7 +360,21 @@ class MainThread():
 
         if self.pli.measurment_done():
             self.state = self.State.LIVE
-            self.pli.run_analysis(self.enable_pli_results)
+            self.pli.run_analysis(self.enable_pli_results,
+                                  self.tracker.get_mask())
+
+    def preview_image(self, frame: np.ndarray) -> np.ndarray:
+        """ direction of the running measurement, frame if not available """
+        preview = self.pli.preview()
+        if preview is None:
+            return frame
+
+        direction = preview[1] + self.pli.offset()
+        direction %= np.pi
+        direction += np.pi
+        direction %= np.pi
+        image = (direction / np.pi * 255).astype(np.uint8)
+        return self.tracker.mask_img(image)
 
     def next_tracking(self, frame: np.ndarray):
         self.show_image(frame)
@@ -508,7 +571,7 @@ class MainThread():
 
     # TODO has nothing to do with worker
     def save_images(self):
-        if self.pli._inclination is None:
+        if not self.pli.analysis_done():
             self.parent.statusbar.showMessage('Images not ready yet', 4200)
             return
 
@@ -523,11 +586,7 @@ class MainThread():
                                            'Save Images',
                                            options=options)
 
-        for file in [
-                'rotations.txt', 'stack.tif'
-                'transmittance.tif', 'direction.tif', 'retardation.tif',
-                'mask.tif', 'inclination.tif', 'fom.tif'
-        ]:
+        for file in export.FILES:
             if os.path.isfile(os.path.join(path, file)):
                 qm = QtWidgets.QMessageBox
                 flag = qm.question(self.parent, '',
@@ -539,35 +598,7 @@ class MainThread():
                 break
 
         if path:
-            np.savetxt(os.path.join(path, 'rotations.txt'),
-                       self.pli.rotations())
-            stack = []
-            data = np.moveaxis(self.pli.images(self._tilt.value), -1, 0)
-            for img in data:
-                stack.append(PIL.Image.fromarray(
-                    self.tracker.rev_crop_img(img)))
-            stack[0].save(os.path.join(path, 'stack.tif'),
-                          save_all=True,
-                          append_images=stack[1:])
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(self.pli.transmittance()))
-            img.save(os.path.join(path, 'transmittance.tif'))
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(self.pli.direction()))
-            img.save(os.path.join(path, 'direction.tif'))
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(self.pli.retardation()))
-            img.save(os.path.join(path, 'retardation.tif'))
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(self.pli.wm_mask()))
-            img.save(os.path.join(path, 'wm_mask.tif'))
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(self.pli.inclination()))
-            img.save(os.path.join(path, 'inclination.tif'))
-            fom = self.pli.fom() * 255
-            img = PIL.Image.fromarray(
-                self.tracker.rev_crop_img(fom.astype(np.uint8)))
-            img.save(os.path.join(path, 'fom.tif'))
+            export.write_images(path, self.pli, self.tracker, self._tilt.value)
 
         else:
             self.parent.statusbar.showMessage('Invalid path', 4200)
@@ -584,3 +615,60 @@ class MainThread():
             offset = np.deg2rad(offset)
             self.pli.apply_offset(offset)
             self.parent.main_menu['pli'][self._last_img_name].trigger()
+
+    # TODO has nothing to do with worker
+    def save_session(self):
+        if not self.pli.analysis_done():
+            self.parent.statusbar.showMessage('Session not ready yet', 4200)
+            return
+
+        if (was_active := self.parent.worker.isActive()):
+            self.parent.worker.stop()
+
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self.parent, "Save Session", "",
+            "PLI Sessions (*.pli);;All Files (*)")
+
+        if file_name:
+            if not pathlib.Path(file_name).suffix:
+                file_name += '.pli'
+            session.save(file_name, {
+                'pli': self.pli.state(),
+                'tracker': self.tracker.state()
+            })
+        else:
+            self.parent.statusbar.showMessage('Invalid file name', 4200)
+
+        if was_active:
+            self.parent.worker.start(self.parent._mspf)
+
+    # TODO has nothing to do with worker
+    def load_session(self):
+        if (was_active := self.parent.worker.isActive()):
+            self.parent.worker.stop()
+
+        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.parent, "Load Session", "",
+            "PLI Sessions (*.pli);;All Files (*)")
+
+        if not file_name:
+            self.parent.statusbar.showMessage('Invalid file name', 4200)
+            if was_active:
+                self.parent.worker.start(self.parent._mspf)
+            return
+
+        state = session.load(file_name)
+        self.pli.restore(state['pli'])
+        self.tracker.restore(state.get('tracker', {}))
+        self._xy_buffer = []
+        self.parent.plotwidget.clear()
+
+        if not self.pli.analysis_done():
+            # measurement without results
+            self.to_live_mode()
+            return
+
+        # no camera needed, show results directly
+        self.state = self.State.LIVE
+        self.enable_pli_results()
+        self.parent.main_menu['pli']['transmittance'].trigger()
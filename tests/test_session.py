@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import pytest
+
+from src import pli, session, tracker
+
+SHAPE = (540, 960)
+CENTER = (480.0, 270.0)
+
+
+def sticker_frame(angle=0.0):
+    """ illuminated disk surrounded by ten aruco stickers, ids 1 to 10 """
+    image = np.zeros(SHAPE, np.uint8)
+    yy, xx = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    disk = (xx - CENTER[0])**2 + (yy - CENTER[1])**2 < 165**2
+    image[disk] = 120
+
+    dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
+    for k, sticker_id in enumerate(range(1, 11)):
+        marker = cv2.aruco.drawMarker(dictionary, sticker_id, 36)
+        marker = 255 - np.pad(marker, 6, constant_values=255)
+        phi = 2 * np.pi * k / 10
+        x = int(CENTER[0] + 210 * np.cos(phi) - marker.shape[1] / 2)
+        y = int(CENTER[1] + 210 * np.sin(phi) - marker.shape[0] / 2)
+        image[y:y + marker.shape[0], x:x + marker.shape[1]] = marker
+
+    rotation = cv2.getRotationMatrix2D(CENTER, np.rad2deg(angle), 1.0)
+    return cv2.warpAffine(image, rotation, SHAPE[::-1])
+
+
+@pytest.fixture
+def restored(tmp_path):
+    """ tracker and pli of a saved and loaded incomplete measurement """
+    tracker_ = tracker.Tracker(num_sticker=10, sticker_zero_id=10)
+    assert tracker_.calibrate(sticker_frame())
+    pli_ = pli.PLI(np.deg2rad(2.5))
+    frame = tracker_.mask_img(tracker_.crop_img(sticker_frame()))
+    pli_.insert(frame, 0)
+
+    file_name = tmp_path / 'session.pli'
+    session.save(str(file_name), {
+        'pli': pli_.state(),
+        'tracker': tracker_.state()
+    })
+    state = session.load(str(file_name))
+
+    tracker_ = tracker.Tracker(num_sticker=10, sticker_zero_id=10)
+    tracker_.restore(state['tracker'])
+    pli_ = pli.PLI(np.deg2rad(2.5))
+    pli_.restore(state['pli'])
+    return tracker_, pli_
+
+
+def test_restored_session_tracks_its_camera(restored):
+    tracker_, _ = restored
+    assert tracker_.calibrated()
+    assert tracker_.current_angle(sticker_frame()) is not None
+
+
+def test_restored_session_ignores_other_frame_shapes(restored):
+    tracker_, pli_ = restored
+    other = np.zeros((240, 244, 3), np.uint8)
+
+    assert not tracker_.matches(other)
+    assert tracker_.current_angle(other) is None
+    assert np.isnan(tracker_.current_angles([other])).all()
+
+    pli_.insert(other[:, :, 0], np.deg2rad(10))
+    assert np.sum(pli_.valid()) == 1
+    assert not pli_.measurment_done()
+
+
+def test_restored_session_keeps_its_final_result(tmp_path):
+    pli_ = pli.PLI(np.deg2rad(2.5))
+    rng = np.random.default_rng(0)
+    for rho in np.linspace(0, np.pi, 18, False):
+        pli_.insert(rng.integers(20, 220, (64, 80), np.uint8), rho)
+    assert pli_.measurment_done()
+    assert not pli_.analysis_done()
+
+    pli_.analyse()
+    assert pli_.analysis_done()
+
+    file_name = tmp_path / 'session.pli'
+    session.save(str(file_name), {'pli': pli_.state()})
+    restored = pli.PLI(np.deg2rad(2.5))
+    restored.restore(session.load(str(file_name))['pli'])
+    assert restored.analysis_done()
+
+    restored.reset()
+    assert not restored.analysis_done()
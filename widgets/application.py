@@ -259,6 +259,12 @@ class Application(QtWidgets.QMainWindow):
                                            lambda: self.app.save_images())
         self.main_menu['tools'].add_action('apply offset',
                                            lambda: self.app.apply_offset())
+        self.main_menu['tools'].add_action('live preview',
+                                           lambda: self.app.switch_preview())
+        self.main_menu['tools'].add_action('save session',
+                                           lambda: self.app.save_session())
+        self.main_menu['tools'].add_action('load session',
+                                           lambda: self.app.load_session())
 
         self.main_menu['help'].add_action('debug',
                                           lambda: self.app.switch_debug())
@@ -319,7 +325,7 @@ class Application(QtWidgets.QMainWindow):
                 self.app.pli.inclination(self.app._tilt.value), 1, 'inclination'
             ))
         self.main_menu['pli'].add_action(
-            'fom', lambda: show_img_and_stop(self.app.pli.fom(), 1, 'fom'))
+            'fom', lambda: show_img_and_stop(self.app.pli.fom(), 255, 'fom'))
 
         self.main_menu['pli'].add_menu('tilts')
 